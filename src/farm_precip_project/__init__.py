@@ -1,20 +1,92 @@
-from .scrape_precip import txt_to_csv, read_url_txt, normalized_data
-from .scrape_farm import row_by_label, extract_state_rows, scrape_farm_data
-from .eda_work import basic_summary, precip_trend_figure, crop_income_fig, precip_v_income, statcompscatt, correl, heatmap
-from .analysis import remove_outliers, center_column, corr_and_plot, make_scatter_w_cat
-from .merge_csvs import merge_csvs
+import importlib
+
+# merge_csvs is both a submodule and a function. Import it eagerly so the
+# package attribute is always the function, even after other code imports
+# the `.merge_csvs` submodule.
+from .merge_csvs import merge_csvs, merge_frames
 # import from all .py coding
 # all code should be in this folder
 # uv pip install -e .
 # uv run quarto preview
 
+# Everything else is loaded on first attribute access (PEP 562), so
+# `import farm_precip_project` does not pull in matplotlib/seaborn
+# (eda_work, analysis) or requests (scrape_precip) until they are used.
+_LAZY_SUBMODULES = {
+    ".scrape_precip": [
+        "txt_to_csv", "read_url_txt", "normalized_data",
+        "read_climdiv", "parse_climdiv_lines", "compare_txt_parsers", "CLIMDIV_COLSPECS", "CLIMDIV_COLS",
+        "ingest_climdiv", "weighted_state_features", "CLIMDIV_ELEMENTS",
+    ],
+    ".scrape_farm": [
+        "row_by_label", "extract_state_rows", "scrape_farm_data",
+        "read_state_blocks", "block_to_frame", "build_farm_frame", "compare_farm_readers",
+    ],
+    ".eda_work": [
+        "basic_summary", "precip_trend_figure", "crop_income_fig", "precip_v_income",
+        "statcompscatt", "correl", "heatmap",
+    ],
+    ".analysis": ["remove_outliers", "center_column", "corr_and_plot", "make_scatter_w_cat",
+                  "transform", "TransformPlan", "clear_transform_cache"],
+    ".regression": ["state_ols", "state_regressions", "t_pvalue"],
+    ".resampling": ["bootstrap_corr", "permutation_corr"],
+    ".render": ["render_figures", "render_spec", "site_figures", "state_crop_figures", "spec_hash"],
+    ".correlation": ["precip_features", "correlation_matrix", "crop_precip_correlations", "WINDOWS"],
+    ".storage": ["read_table", "write_table", "iter_table_chunks", "storage_format"],
+    ".panel": ["write_panel", "open_panel", "PanelStore"],
+    ".cache": ["file_hash", "cache_key", "run_cached", "invalidate_cache", "cache_stats", "reset_cache_stats"],
+    ".download": ["download_file", "download_many", "refresh_txt_files"],
+    ".incremental": ["refresh_rain_clean", "refresh_combined", "incremental_refresh", "upsert_table"],
+    ".benchmarks": ["bench_import", "bench_resampling", "run_benchmarks", "compare_benchmarks",
+                    "prepare_bench_inputs", "BenchmarkRegression"],
+    ".pipeline": ["run_pipeline", "pipeline_stages", "stage_graph", "load_config"],
+    ".instrument": ["enable_instrumentation", "disable_instrumentation", "instrumentation_enabled",
+                    "instrumentation_summary", "instrumentation_records", "reset_instrumentation"],
+}
+_LAZY = {name: module for module, names in _LAZY_SUBMODULES.items() for name in names}
+_SUBMODULES = {module[1:] for module in _LAZY_SUBMODULES}
+
 __all__ = [
     "txt_to_csv", "read_url_txt", "normalized_data",
+    "read_climdiv", "parse_climdiv_lines", "compare_txt_parsers", "CLIMDIV_COLSPECS", "CLIMDIV_COLS",
+    "ingest_climdiv", "weighted_state_features", "CLIMDIV_ELEMENTS",
     "row_by_label", "extract_state_rows", "scrape_farm_data",
+    "read_state_blocks", "block_to_frame", "build_farm_frame", "compare_farm_readers",
     "basic_summary", "precip_trend_figure", "crop_income_fig", "precip_v_income",
     "statcompscatt", "correl", "heatmap",
     "remove_outliers", "center_column", "corr_and_plot", "make_scatter_w_cat",
-    "merge_csvs",
+    "transform", "TransformPlan", "clear_transform_cache",
+    "state_ols", "state_regressions", "t_pvalue",
+    "bootstrap_corr", "permutation_corr",
+    "render_figures", "render_spec", "site_figures", "state_crop_figures", "spec_hash",
+    "precip_features", "correlation_matrix", "crop_precip_correlations", "WINDOWS",
+    "merge_csvs", "merge_frames",
+    "read_table", "write_table", "iter_table_chunks", "storage_format",
+    "write_panel", "open_panel", "PanelStore",
+    "file_hash", "cache_key", "run_cached", "invalidate_cache", "cache_stats", "reset_cache_stats",
+    "download_file", "download_many", "refresh_txt_files",
+    "refresh_rain_clean", "refresh_combined", "incremental_refresh", "upsert_table",
+    "bench_import", "bench_resampling", "run_benchmarks", "compare_benchmarks", "prepare_bench_inputs",
+    "BenchmarkRegression",
+    "run_pipeline", "pipeline_stages", "stage_graph", "load_config",
+    "enable_instrumentation", "disable_instrumentation", "instrumentation_enabled",
+    "instrumentation_summary", "instrumentation_records", "reset_instrumentation",
 ]
 
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
 __version__ = "0.1.2"
\ No newline at end of file
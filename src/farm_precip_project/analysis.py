@@ -1,54 +1,306 @@
+import hashlib
+import operator
+import weakref
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 
+from .instrument import instrument
+
+# ---------------------------------------------------------
+# Lazy transform plans
+# ---------------------------------------------------------
+# A plan is a base frame plus a tuple of steps:
+#   ("filter", col, op, value)         keep rows where col <op> value
+#   ("center", col, by, name)          col minus its group mean
+#   ("standardize", col, by, name)     (col - group mean) / group std
+#   ("select", cols)                   output columns
+# Steps apply in order: a center after a filter uses the kept rows' means.
+# Running a plan reads the needed base columns as NumPy arrays, ANDs the
+# filter masks into one mask, computes group statistics with bincount on
+# group codes, and builds the output frame once at the end. With
+# run(memo=True), results and group codes are memoized per base frame,
+# keyed by the steps and a content hash of every column read, so in-place
+# edits of the base frame are seen too.
+
+_FILTER_OPS = {
+    ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le,
+    "==": operator.eq, "!=": operator.ne,
+}
+
+# Memoized results kept per base frame
+PLAN_CACHE_SIZE = 32
+
+_plan_memo = {}
+
+
+def _as_tuple(cols):
+    return (cols,) if isinstance(cols, str) else tuple(cols)
+
+
+def _column_token(df, col):
+    # Hash of the values in row order: replacing a column or editing it in
+    # place (df.loc[...] = v, df[col].values[...] = v) both change it
+    s = df[col]
+    digest = hashlib.blake2b(pd.util.hash_pandas_object(s, index=False).to_numpy().tobytes(), digest_size=16)
+    return col, str(s.dtype), digest.hexdigest()
+
+
+def _index_token(df):
+    return hashlib.blake2b(pd.util.hash_pandas_object(df.index).to_numpy().tobytes(),
+                           digest_size=16).hexdigest()
+
+
+def _memo_for(df):
+    key = id(df)
+    if key not in _plan_memo:
+        _plan_memo[key] = {"codes": {}, "results": OrderedDict()}
+        weakref.finalize(df, _plan_memo.pop, key, None)
+    return _plan_memo[key]
+
+
+def clear_transform_cache():
+    """Drops all memoized plan results and group codes (e.g. to free their memory)."""
+    _plan_memo.clear()
+
+
+def _group_codes(df, by, memo, tokens=None):
+    """
+    Dense group codes (-1 for missing keys) and the number of groups,
+    reused from `memo` while the `by` columns' content `tokens` match.
+    """
+    token = None if tokens is None else tuple(tokens[c] for c in by)
+    cached = memo["codes"].get(by)
+    if token is not None and cached is not None and cached[0] == token:
+        return cached[1], cached[2]
+    codes, uniques = pd.factorize(df[by[0]])
+    n = len(uniques)
+    for col in by[1:]:
+        more, more_uniques = pd.factorize(df[col])
+        missing = (codes < 0) | (more < 0)
+        codes, uniques = pd.factorize(codes * len(more_uniques) + more)
+        codes = np.where(missing, -1, codes)
+        n = len(uniques)
+    memo["codes"][by] = (token, codes, n)
+    return codes, n
+
+
+def _group_stats(x, codes, n, keep, std):
+    """Per-row group mean (and std, ddof=1) of x over the rows in `keep`."""
+    use = keep & (codes >= 0) & ~np.isnan(x)
+    c, v = codes[use], x[use]
+    count = np.bincount(c, minlength=n).astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.bincount(c, weights=v, minlength=n) / count
+        # Second pass on the residuals: the mean is then as precise as pandas' compensated sum
+        resid = v - mean[c]
+        mean += np.bincount(c, weights=resid, minlength=n) / count
+        sd = None
+        if std:
+            resid = v - mean[c]
+            sd = np.sqrt(np.bincount(c, weights=resid * resid, minlength=n) / (count - 1))
+    safe = np.where(codes >= 0, codes, 0)
+    row_mean = np.where(codes >= 0, mean[safe], np.nan)
+    row_sd = None if sd is None else np.where(codes >= 0, sd[safe], np.nan)
+    return row_mean, row_sd
+
+
+class TransformPlan:
+    """
+    A lazy chain of row filters, per-group centering/standardizing and
+    column selection over one base frame. Every method returns a new plan;
+    nothing runs until `run`. Start one with `transform(df)`.
+
+    Example
+    -------
+    >>> plan = (transform(df)
+    ...         .filter("yearly_avg", ">", -10)
+    ...         .center("Crop cash receipts", "state", "income_centered")
+    ...         .select(["state", "year", "yearly_avg", "income_centered"]))
+    >>> out = plan.run()
+    """
 
+    def __init__(self, df, steps=()):
+        self.df = df
+        self.steps = tuple(steps)
+
+    def __repr__(self):
+        return f"TransformPlan({len(self.df)} rows, steps={list(self.steps)})"
+
+    def _then(self, step):
+        return TransformPlan(self.df, self.steps + (step,))
+
+    def filter(self, col, op, value=None):
+        """Keeps rows where `col op value`; op is one of > >= < <= == != or "notna"."""
+        if op not in _FILTER_OPS and op != "notna":
+            raise ValueError(f"op must be one of {list(_FILTER_OPS) + ['notna']}, not {op!r}")
+        return self._then(("filter", col, op, value))
+
+    def center(self, col, by, name=None):
+        """Adds `name` (default: replaces `col`) = col minus its mean within the `by` groups."""
+        return self._then(("center", col, _as_tuple(by), name or col))
+
+    def standardize(self, col, by, name=None):
+        """Like `center`, divided by the group standard deviation (ddof=1)."""
+        return self._then(("standardize", col, _as_tuple(by), name or col))
+
+    def select(self, cols):
+        """Keeps only these output columns, in this order. Unused steps are skipped."""
+        return self._then(("select", _as_tuple(cols)))
+
+    def _needed_steps(self):
+        """Drops center/standardize steps whose column is never selected or used later."""
+        selected = None
+        for step in self.steps:
+            if step[0] == "select":
+                selected = step[1] if selected is None else tuple(c for c in step[1] if c in selected)
+        if selected is None:
+            return [s for s in self.steps if s[0] != "select"], None
+        needed, steps = set(selected), []
+        for step in reversed(self.steps):
+            if step[0] == "select":
+                continue
+            if step[0] == "filter":
+                needed.add(step[1])
+            elif step[3] in needed:
+                needed.discard(step[3])
+                needed.update((step[1],) + step[2])
+            else:
+                continue
+            steps.append(step)
+        return steps[::-1], selected
+
+    def run(self, memo=False):
+        """
+        Runs the plan in one pass over the base frame.
+
+        Parameters
+        ----------
+        memo : bool
+            Reuse the result of an earlier run of the same steps on the
+            same base frame, and its group codes. The key includes a
+            content hash of every column read, so editing the base frame
+            in place invalidates it. Hashing costs a pass over those
+            columns, so it pays off when the groups or steps are costly
+            and the frame is reused (e.g. a shared frame in the app).
+            Either way the result is a new frame the caller can modify.
+
+        Returns
+        -------
+        pd.DataFrame
+            Kept rows (base index preserved), base columns (or the
+            selection) plus the derived columns.
+        """
+        df = self.df
+        steps, selected = self._needed_steps()
+        derived = [s[3] for s in steps if s[0] in ("center", "standardize")]
+        out_cols = selected if selected is not None else tuple(
+            list(df.columns) + [c for c in dict.fromkeys(derived) if c not in df.columns])
+        reads = {c for c in out_cols if c not in derived}
+        for step in steps:
+            reads.add(step[1])
+            if step[0] != "filter":
+                reads.update(step[2])
+        reads = sorted(c for c in reads if c in df.columns)
+
+        memo_entry, tokens = None, None
+        if memo:
+            memo_entry = _memo_for(df)
+            tokens = {c: _column_token(df, c) for c in dict.fromkeys(
+                reads + [g for s in steps if s[0] != "filter" for g in s[2]])}
+            key = (tuple(steps), out_cols, tuple(df.columns), tuple(tokens[c] for c in reads), _index_token(df))
+            if key in memo_entry["results"]:
+                memo_entry["results"].move_to_end(key)
+                # Deep copy: the cached frame must not share memory with the caller's
+                return memo_entry["results"][key].copy()
+
+        keep = np.ones(len(df), dtype=bool)
+        # Columns made by earlier steps; they shadow base columns of the same name
+        made = {}
+
+        def values(col):
+            if col in made:
+                return made[col]
+            if col not in df.columns:
+                raise KeyError(f"column {col!r} is not in the frame or produced by an earlier step")
+            return df[col]
+
+        for step in steps:
+            if step[0] == "filter":
+                _, col, op, value = step
+                v = values(col)
+                if op == "notna":
+                    keep &= ~np.asarray(pd.isna(v))
+                    continue
+                with np.errstate(invalid="ignore"):
+                    hit = _FILTER_OPS[op](v, value)
+                # Missing values never pass, as with df[df[col] > value]
+                keep &= (hit.to_numpy(dtype=bool, na_value=False) if isinstance(hit, pd.Series)
+                         else np.asarray(hit, dtype=bool))
+            else:
+                kind, col, by, name = step
+                codes, n = _group_codes(df, by, memo_entry or {"codes": {}}, tokens)
+                x = values(col)
+                x = x if isinstance(x, np.ndarray) else x.to_numpy(dtype=np.float64, na_value=np.nan)
+                mean, sd = _group_stats(x, codes, n, keep, kind == "standardize")
+                made[name] = (x - mean) if sd is None else (x - mean) / sd
+
+        rows = np.flatnonzero(keep)
+        # Built from taken arrays, so the result is a fresh frame rather than a view of `df`
+        result = pd.DataFrame(
+            {c: made[c][rows] if c in made else df[c].array.take(rows) for c in out_cols},
+            index=df.index[rows],
+        )
+        if memo_entry is not None:
+            memo_entry["results"][key] = result
+            if len(memo_entry["results"]) > PLAN_CACHE_SIZE:
+                memo_entry["results"].popitem(last=False)
+            return result.copy()
+        return result
+
+
+def transform(df):
+    """Starts a lazy `TransformPlan` over `df` (which is never modified)."""
+    return TransformPlan(df)
+
+
+@instrument
 def remove_outliers(df, col_name, threshold, lower = True):
-    if lower:
-        df = df[df[col_name] > threshold]
-        return df
-    else:
-        df = df[df[col_name] < threshold]
-        return df
+    # Unmemoized one-step plan: a new frame with its own arrays (not a view
+    # of df), so assigning into it changes neither df nor later calls
+    return transform(df).filter(col_name, ">" if lower else "<", threshold).run()
 
+@instrument
 def center_column(df, col_name, col_group, col_stand_name):
+    # Kept as before on purpose: adds the column to the caller's df and
+    # returns it, with pandas' group means (bit-identical to earlier
+    # releases). transform(df).center(...).run() leaves df untouched.
     mean_state_col = df.groupby(col_group)[col_name].transform('mean')
     df[col_stand_name] = (df[col_name] - mean_state_col)
     return df
 
-def corr_and_plot(df, col1, col2, plot_file, n_digits):
-    correlation = round(df[col1].corr(df[col2]),n_digits)
-    
-    plt.figure(figsize=(8, 6))
-    plt.scatter(df[col1], df[col2])
-    plt.title(f'Scatter plot of {col1} vs {col2}, Correlation: {correlation}')
-    plt.xlabel(col1)
-    plt.ylabel(col2)
+@instrument
+def corr_and_plot(df, col1, col2, plot_file, n_digits, mode="auto"):
+    import matplotlib.pyplot as plt
+    from .render import draw_scatter
+
+    fig = plt.figure(figsize=(8, 6))
+    draw_scatter(fig, df, col1, col2, n_digits=n_digits, mode=mode)
+    # Save before show: with an interactive backend show() can leave an empty canvas
+    fig.savefig(f"plots/{plot_file}")
     plt.show()
-    plt.savefig(f"plots/{plot_file}")
-    return plt.gcf()
-
-
-def make_scatter_w_cat(df, colx, coly, colcat, plot_file):
-    cat_order = sorted(df[colcat].unique())
-    palette = sns.color_palette("husl", len(cat_order))
-
-    sns.scatterplot(
-    data=df,
-    x=colx,
-    y=coly,
-    hue=colcat,
-    hue_order=cat_order,
-    palette=palette,
-    s=30
-    )
-
-    leg = plt.legend(title=colcat, bbox_to_anchor=(1.02, 1), 
-                     loc="upper left", borderaxespad=0.,
-                     ncol = 2)
-    for text in leg.get_texts():
-        text.set_fontsize(8)  # smaller labels
+    return fig
+
+
+@instrument
+def make_scatter_w_cat(df, colx, coly, colcat, plot_file, mode="auto", fit_lines=None):
+    import matplotlib.pyplot as plt
+    from .render import draw_scatter_by_category
 
+    fig = plt.figure()
+    # Large inputs become a hexbin with one fit line per category
+    draw_scatter_by_category(fig, df, colx, coly, colcat, mode=mode, fit_lines=fit_lines)
+    fig.savefig(f"plots/{plot_file}")
     plt.show()
-    plt.savefig(f"plots/{plot_file}")
-    return plt.gcf()
+    return fig
@@ -0,0 +1,516 @@
+import json
+import subprocess
+import sys
+import time
+
+# Run in a fresh interpreter so nothing is already in sys.modules
+_IMPORT_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+heavy = [m for m in ("matplotlib", "seaborn", "requests", "openpyxl") if m in sys.modules]
+print(json.dumps({{"seconds": elapsed, "loaded": heavy}}))
+"""
+
+
+def bench_import(statement="import farm_precip_project", repeat=5):
+    """
+    Times a cold import in a fresh interpreter, `repeat` times.
+
+    Parameters
+    ----------
+    statement : str
+        Import statement to time, e.g. "from farm_precip_project import merge_csvs".
+    repeat : int
+        Number of fresh interpreters to start.
+
+    Returns
+    -------
+    dict
+        Best and median seconds, plus which heavy dependencies
+        (matplotlib, seaborn, requests, openpyxl) the statement loaded.
+    """
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", _IMPORT_SNIPPET.format(statement=statement)],
+            capture_output=True, text=True, check=True,
+        )
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    seconds = sorted(r["seconds"] for r in runs)
+    result = {
+        "statement": statement,
+        "best": seconds[0],
+        "median": seconds[len(seconds) // 2],
+        "loaded": runs[-1]["loaded"],
+    }
+    print(f"{statement}: best {result['best']:.3f}s, median {result['median']:.3f}s, "
+          f"heavy modules loaded: {', '.join(result['loaded']) or 'none'}")
+    return result
+
+
+def bench_resampling(df=None, n_resamples=10_000, workers=None, repeat=3, income_col="Crop cash receipts"):
+    """
+    Measures bootstrap and permutation throughput on the state-centered
+    correlation.
+
+    Parameters
+    ----------
+    df : pd.DataFrame or None
+        Merged table; None reads combined_farm_precip.csv.
+    n_resamples : int
+        Resamples per run.
+    workers : int or None
+        Passed to `bootstrap_corr` / `permutation_corr`.
+    repeat : int
+        Runs per method; the best is reported.
+    income_col : str
+        Income column to center by state.
+
+    Returns
+    -------
+    dict
+        Resamples per second for "bootstrap" and "permutation".
+    """
+    import pandas as pd
+    from .analysis import center_column
+    from .resampling import bootstrap_corr, permutation_corr
+
+    if df is None:
+        df = pd.read_csv("combined_farm_precip.csv")
+    df = center_column(df.copy(), income_col, ["state"], "income_centered")
+
+    result = {}
+    for name, func in (("bootstrap", bootstrap_corr), ("permutation", permutation_corr)):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(df, y="income_centered", n_resamples=n_resamples, seed=0, workers=workers)
+            best = min(best, time.perf_counter() - start)
+        result[name] = n_resamples / best
+        print(f"{name}: {result[name]:,.0f} resamples/s ({n_resamples} resamples, "
+              f"{len(df)} rows, {workers or 1} worker(s))")
+    return result
+
+
+# ---------------------------------------------------------
+# Pipeline benchmark suite
+# ---------------------------------------------------------
+# Every stage of the pipeline is timed on the checked-in data (scale 1) and
+# on synthetic inputs with the same layouts scaled 10x, 100x, ... Each stage
+# runs in a fresh interpreter so its peak memory is its own. Results can be
+# saved as a baseline and later runs compared against it.
+
+BENCH_STAGES = ["txt_to_csv", "normalized_data", "scrape_farm", "merge_csvs", "center_column", "plots"]
+
+# Checked-in inputs, copied into the scale-1 work directory
+_BENCH_INPUTS = {"rain.txt": "rain.txt", "farm.xlsx": "FarmIncome.xlsx", "va.xlsx": "VA_State_US (1).xlsx"}
+
+# Limits of the synthetic layouts: two-digit state and division codes in the
+# climdiv id, four-digit years, and Excel's 16,384 columns per sheet
+_MAX_CODE = 99
+_FIRST_YEAR = 1895
+_FIRST_FARM_YEAR = 1924
+_MAX_YEARS = 9999 - _FIRST_YEAR + 1
+_MAX_SHEET_COLUMNS = 16_384
+
+# Bump when the synthetic shapes change, so stale generated inputs are not reused
+_INPUT_LAYOUT = 2
+
+
+class BenchmarkRegression(AssertionError):
+    """Raised by `compare_benchmarks` when a stage got slower or bigger than the baseline."""
+
+
+def _synthetic_shape(scale):
+    """
+    Splits `scale` over states, divisions and years for the climdiv file,
+    and over states and years for the workbooks.
+
+    Both files share their states and the farm years lie inside the
+    climdiv years, so the merged (state, year) panel, and with it the
+    merge_csvs, center_column and plots stages, grows with the scale too.
+    Years grow before divisions; past about 250x the panel stops growing
+    (four-digit years) and only the climdiv divisions do.
+
+    Returns (climdiv states, divisions per state, years), (workbook states, years).
+    """
+    states = 48 * min(scale, _MAX_CODE // 48)
+    rest = scale / (states / 48)
+    years = min(int(round(120 * rest)), _MAX_YEARS)
+    divisions = 7 * max(1, min(int(round(120 * rest / years)), _MAX_CODE // 7))
+    farm_years = min(int(round(102 * rest)), years - (_FIRST_FARM_YEAR - _FIRST_YEAR), _MAX_SHEET_COLUMNS - 1)
+    return (states, divisions, years), (states, farm_years)
+
+
+def _put_digits(buf, start, width, values):
+    """Writes non-negative ints zero padded into buf[:, start:start + width]."""
+    for i in range(width - 1, -1, -1):
+        buf[:, start + i] = 48 + values % 10
+        values = values // 10
+
+
+def write_synthetic_climdiv(path, n_states, n_divisions, n_years, seed=0, chunk_lines=1_000_000):
+    """
+    Writes a NOAA climdiv style fixed-width file (see CLIMDIV_COLSPECS):
+    every (state, division, year) once, twelve "%7.2f" monthly values with
+    about 0.5% -99.99 sentinels.
+
+    Lines are formatted as uint8 arrays in chunks, so large files are
+    written at disk speed.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    n = n_states * n_divisions * n_years
+    width = 95
+    with open(path, "wb") as f:
+        for lo in range(0, n, chunk_lines):
+            i = np.arange(lo, min(n, lo + chunk_lines))
+            buf = np.full((len(i), width), ord(" "), dtype=np.uint8)
+            buf[:, -1] = ord("\n")
+            _put_digits(buf, 0, 2, 1 + i // (n_divisions * n_years))
+            _put_digits(buf, 2, 2, 1 + i // n_years % n_divisions)
+            _put_digits(buf, 4, 2, np.full(len(i), 5))
+            _put_digits(buf, 6, 4, _FIRST_YEAR + i % n_years)
+
+            values = np.clip(rng.normal(0.0, 2.5, (len(i), 12)), -20.0, 20.0)
+            values[rng.random(values.shape) < 0.005] = -99.99
+            cents = np.rint(np.abs(values) * 100).astype(np.int64)
+            neg = (values < 0) & (cents > 0)
+            whole, frac = cents // 100, cents % 100
+            for m in range(12):
+                st = 10 + 7 * m
+                buf[:, st + 6] = 48 + frac[:, m] % 10
+                buf[:, st + 5] = 48 + frac[:, m] // 10
+                buf[:, st + 4] = ord(".")
+                buf[:, st + 3] = 48 + whole[:, m] % 10
+                tens = whole[:, m] // 10
+                buf[:, st + 2] = np.where(tens > 0, 48 + tens, np.where(neg[:, m], ord("-"), ord(" ")))
+                buf[:, st + 1] = np.where((tens > 0) & neg[:, m], ord("-"), ord(" "))
+            f.write(buf.tobytes())
+
+
+def write_synthetic_workbooks(farm_path, va_path, sheet_names, years, seed=0):
+    """
+    Writes a FarmIncome-style workbook (Sheet1: state, year and the crop
+    columns, one row per year) and a VA_State_US-style workbook with one
+    sheet per name: title, year header on row 2, then one row per
+    CROP_LABELS entry with integer values and some "NA" cells.
+    """
+    import numpy as np
+    from openpyxl import Workbook
+    from .scrape_farm import CROP_LABELS
+
+    rng = np.random.default_rng(seed)
+    header = [str(y) for y in years]
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    ws.append(["state", "year"] + CROP_LABELS)
+    for y in years:
+        ws.append([1, int(y)] + [0] * len(CROP_LABELS))
+    wb.save(farm_path)
+
+    wb = Workbook(write_only=True)
+    for name in sheet_names:
+        ws = wb.create_sheet(name)
+        ws.append([f"Value added to the U.S. economy by the agricultural sector, {name}"])
+        ws.append([])
+        ws.append([name] + header)
+        ws.append([None] + ["$1,000"] * len(years))
+        ws.append([])
+        values = rng.integers(-50_000, 5_000_000, (len(CROP_LABELS), len(years))).astype(object)
+        values[rng.random(values.shape) < 0.02] = "NA"
+        for label, row in zip(CROP_LABELS, values.tolist()):
+            ws.append([label] + row)
+        ws.append(["Livestock and products"] + rng.integers(0, 5_000_000, len(years)).tolist())
+    wb.save(va_path)
+
+
+def prepare_bench_inputs(scale, root=None, seed=0):
+    """
+    Creates (or reuses) the inputs for one scale: rain.txt, farm.xlsx,
+    va.xlsx and states.json (the sheet names to read) in
+    <root>/v<layout>/scale_<scale>. Scale 1 copies the checked-in files;
+    larger scales are synthetic and deterministic for a given seed.
+
+    Returns
+    -------
+    str
+        The input directory.
+    """
+    import os
+    import shutil
+    from .cache import CACHE_DIR
+    from .scrape_farm import CONTIGUOUS_STATES
+
+    root = os.path.join(CACHE_DIR, "bench") if root is None else root
+    path = os.path.abspath(os.path.join(root, f"v{_INPUT_LAYOUT}", f"scale_{scale}"))
+    done = os.path.join(path, "states.json")
+    if os.path.exists(done):
+        return path
+    os.makedirs(path, exist_ok=True)
+
+    if scale == 1:
+        for dst, src in _BENCH_INPUTS.items():
+            shutil.copyfile(src, os.path.join(path, dst))
+        names = CONTIGUOUS_STATES
+    else:
+        (states, divisions, years), (farm_states, farm_years) = _synthetic_shape(scale)
+        write_synthetic_climdiv(os.path.join(path, "rain.txt"), states, divisions, years, seed)
+        names = CONTIGUOUS_STATES + [f"Synthetic {i}" for i in range(len(CONTIGUOUS_STATES) + 1, farm_states + 1)]
+        write_synthetic_workbooks(os.path.join(path, "farm.xlsx"), os.path.join(path, "va.xlsx"), names,
+                                  range(_FIRST_FARM_YEAR, _FIRST_FARM_YEAR + farm_years), seed)
+    # Written last: its presence marks a complete input directory
+    with open(done, "w") as f:
+        json.dump(names, f)
+    return path
+
+
+def _stage_setup(stage, txt_engine):
+    """
+    Runs the untimed part of `stage` in the current directory and returns
+    the timed part as a callable returning the number of rows it produced
+    (None for stages that only write files).
+    """
+    import pandas as pd
+    from . import scrape_precip
+    from .analysis import center_column
+    from .merge_csvs import merge_csvs
+    from .scrape_farm import build_farm_frame
+    from .storage import write_table
+
+    if stage == "txt_to_csv":
+        def run():
+            scrape_precip.txt_to_csv("rain.txt", "rain_dirty.csv", scrape_precip.CLIMDIV_COLSPECS,
+                                     scrape_precip.CLIMDIV_COLS, engine=txt_engine)
+            return None
+        return run
+    if stage == "normalized_data":
+        def run():
+            scrape_precip.normalized_data("rain_dirty.csv", "yearly_avg", "rain_clean.csv",
+                                          scrape_precip.CLIMDIV_COLS[4:], ["state", "year"])
+            return None
+        return run
+    if stage == "scrape_farm":
+        with open("states.json") as f:
+            names = json.load(f)
+
+        def run():
+            df = build_farm_frame("farm.xlsx", "va.xlsx", states=names)
+            write_table(df, "FarmIncome_full.csv")
+            return len(df)
+        return run
+    if stage == "merge_csvs":
+        def run():
+            df = merge_csvs("combined_farm_precip.csv", ["FarmIncome_full.csv", "rain_clean.csv"], ["state", "year"])
+            return len(df)
+        return run
+    if stage == "center_column":
+        df = pd.read_csv("combined_farm_precip.csv")
+
+        def run():
+            center_column(df, "Crop cash receipts", "state", "income_centered")
+            return len(df)
+        return run
+    if stage == "plots":
+        from .render import render_figures, site_figures
+
+        def run():
+            render_figures(site_figures("combined_farm_precip.csv"), force=True, manifest="render_manifest.json")
+            return None
+        return run
+    raise ValueError(f"unknown benchmark stage {stage!r}")
+
+
+def _bench_stage(stage, txt_engine="fwf", repeat=1):
+    """
+    Child-process entry point: times one stage `repeat` times in the
+    current directory and prints JSON with the fastest time and the
+    largest peak.
+    """
+    from .analysis import clear_transform_cache
+    from .instrument import peak_rss_mb, reset_peak_rss
+
+    run = _stage_setup(stage, txt_engine)
+    best = None
+    for _ in range(repeat):
+        # Every repeat does the full work, never a memoized transform plan
+        clear_transform_cache()
+        reset_peak_rss()
+        before = peak_rss_mb()
+        start, cpu = time.perf_counter(), time.process_time()
+        rows = run()
+        seconds, cpu = time.perf_counter() - start, time.process_time() - cpu
+        peak = peak_rss_mb()
+        result = {
+            "seconds": seconds,
+            "cpu_seconds": cpu,
+            "peak_rss_mb": peak,
+            # Growth of the peak over the footprint after imports and setup
+            "rss_growth_mb": None if peak is None else peak - before,
+            "rows": rows,
+        }
+        if best is None:
+            best = result
+        else:
+            if seconds < best["seconds"]:
+                best.update(seconds=seconds, cpu_seconds=cpu)
+            if peak is not None:
+                best["peak_rss_mb"] = max(best["peak_rss_mb"], peak)
+                best["rss_growth_mb"] = max(best["rss_growth_mb"], result["rss_growth_mb"])
+    print(json.dumps({**best, "repeat": repeat}))
+
+
+def run_benchmarks(scales=(1, 10, 100), stages=None, baseline=None, save_baseline=None, root=None,
+                   txt_engine="fwf", time_tolerance=1.5, memory_tolerance=1.25, min_seconds=0.05, repeat=3):
+    """
+    Runs the pipeline stages at each scale and reports wall time and peak
+    memory per stage.
+
+    Parameters
+    ----------
+    scales : iterable of int
+        1 is the checked-in data; larger values are synthetic inputs with
+        the NOAA fixed-width and VA workbook layouts, that many times
+        bigger. 1000 works but needs several GB of disk and memory and
+        takes a while to generate.
+    stages : list[str] or None
+        Subset of BENCH_STAGES, run in pipeline order. None runs all of
+        them. Each stage reads the previous stages' outputs, so a subset
+        must start from outputs already in the work directory.
+    baseline : str or None
+        JSON file written by an earlier run; if given the results are
+        checked with `compare_benchmarks`, which raises on regressions.
+    save_baseline : str or None
+        If given, the results are written there as the new baseline.
+    root : str or None
+        Where inputs are generated; defaults to <CACHE_DIR>/bench. Inputs
+        are reused across runs.
+    txt_engine : str
+        Engine passed to `txt_to_csv`.
+    time_tolerance, memory_tolerance, min_seconds
+        Passed to `compare_benchmarks`.
+    repeat : int
+        Timed runs per stage; the fastest is reported (with the largest
+        peak memory), which keeps one-off noise out of the comparison.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per (scale, stage).
+    """
+    import os
+    import pandas as pd
+
+    stages = BENCH_STAGES if stages is None else [s for s in BENCH_STAGES if s in stages]
+    # The children run in the input directory, so point them at this copy of the package
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, MPLBACKEND="Agg",
+               PYTHONPATH=os.pathsep.join(filter(None, [src, os.environ.get("PYTHONPATH")])))
+    rows = []
+    for scale in scales:
+        path = prepare_bench_inputs(scale, root)
+        for stage in stages:
+            out = subprocess.run(
+                [sys.executable, "-c",
+                 f"from farm_precip_project.benchmarks import _bench_stage; "
+                 f"_bench_stage({stage!r}, {txt_engine!r}, {int(repeat)})"],
+                cwd=path, env=env, capture_output=True, text=True,
+            )
+            if out.returncode != 0:
+                raise RuntimeError(f"benchmark stage {stage} at scale {scale} failed:\n{out.stderr}")
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            rows.append({"scale": scale, "stage": stage, **result})
+            print(f"scale {scale:>5} {stage:<16} {result['seconds']:8.3f}s  "
+                  f"peak {result['peak_rss_mb'] or float('nan'):8.1f} MB")
+
+    results = pd.DataFrame(rows)
+    if save_baseline is not None:
+        results.to_json(save_baseline, orient="records", indent=1)
+    if baseline is not None:
+        compare_benchmarks(results, baseline, time_tolerance, memory_tolerance, min_seconds)
+    return results
+
+
+def compare_benchmarks(results, baseline, time_tolerance=1.5, memory_tolerance=1.25, min_seconds=0.05):
+    """
+    Compares benchmark results with a saved baseline.
+
+    A stage regresses when its time exceeds `time_tolerance` x the
+    baseline (stages under `min_seconds` in both runs are ignored as
+    noise) or its peak memory exceeds `memory_tolerance` x the baseline.
+    Stages missing from the baseline are not checked.
+
+    Parameters
+    ----------
+    results : pd.DataFrame
+        Output of `run_benchmarks`.
+    baseline : str or pd.DataFrame
+        Baseline JSON file (see `run_benchmarks(save_baseline=...)`) or frame.
+
+    Returns
+    -------
+    pd.DataFrame
+        Results joined to the baseline with time and memory ratios.
+
+    Raises
+    ------
+    BenchmarkRegression
+        Listing every stage that regressed.
+    """
+    import pandas as pd
+
+    if not isinstance(baseline, pd.DataFrame):
+        baseline = pd.read_json(baseline, orient="records")
+    cols = ["scale", "stage", "seconds", "peak_rss_mb"]
+    joined = results[cols].merge(baseline[cols], on=["scale", "stage"], suffixes=("", "_baseline"))
+    joined["time_ratio"] = joined["seconds"] / joined["seconds_baseline"]
+    joined["memory_ratio"] = joined["peak_rss_mb"] / joined["peak_rss_mb_baseline"]
+
+    slow = (joined["time_ratio"] > time_tolerance) & (joined[["seconds", "seconds_baseline"]].max(axis=1) >= min_seconds)
+    big = joined["memory_ratio"] > memory_tolerance
+    print(joined.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+
+    failures = [
+        f"scale {r.scale} {r.stage}: "
+        + ", ".join(part for part, bad in (
+            (f"{r.seconds:.3f}s vs {r.seconds_baseline:.3f}s ({r.time_ratio:.2f}x)", s),
+            (f"{r.peak_rss_mb:.1f} MB vs {r.peak_rss_mb_baseline:.1f} MB ({r.memory_ratio:.2f}x)", b),
+        ) if bad)
+        for r, s, b in zip(joined.itertuples(), slow, big) if s or b
+    ]
+    if failures:
+        raise BenchmarkRegression("benchmark regressions:\n  " + "\n  ".join(failures))
+    return joined
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="farm-precip-bench", description="Time the farm_precip_project pipeline stages.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--stages", nargs="+", choices=BENCH_STAGES)
+    parser.add_argument("--baseline", help="baseline JSON to compare against; exits 1 on regressions")
+    parser.add_argument("--save", help="write the results to this baseline JSON")
+    parser.add_argument("--root", help="where to generate inputs (default <cache dir>/bench)")
+    parser.add_argument("--engine", default="fwf", choices=["fwf", "climdiv"], help="txt_to_csv engine")
+    parser.add_argument("--time-tolerance", type=float, default=1.5)
+    parser.add_argument("--memory-tolerance", type=float, default=1.25)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage; the fastest counts")
+    args = parser.parse_args(argv)
+
+    try:
+        run_benchmarks(args.scales, args.stages, args.baseline, args.save, args.root, args.engine,
+                       args.time_tolerance, args.memory_tolerance, repeat=args.repeat)
+    except BenchmarkRegression as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
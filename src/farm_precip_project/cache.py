@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# Artifacts live under CACHE_DIR/<stage>/<key>/; bump CACHE_VERSION when a
+# stage's output format changes so old entries stop matching.
+#   2 - climdiv sentinels written as NaN, n_months column in rain_clean
+CACHE_DIR = os.environ.get("FPP_CACHE_DIR", ".fpp_cache")
+CACHE_VERSION = 2
+
+_stats = {}
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    Returns the sha256 hex digest of a file's contents, read in chunks.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(stage, inputs, params):
+    """
+    Builds the cache key for one stage call from the content hash of every
+    input file plus the call parameters (colspecs, cols, months, ...).
+    """
+    payload = {
+        "version": CACHE_VERSION,
+        "stage": stage,
+        "inputs": [file_hash(p) for p in inputs],
+        "params": params,
+    }
+    blob = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def _count(stage, kind):
+    counts = _stats.setdefault(stage, {"hits": 0, "misses": 0})
+    counts[kind] += 1
+
+
+def _copy_atomic(src, dst):
+    # Copy next to dst, then rename over it, so a reader never sees half a file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dst)), prefix=".fpp-")
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def run_cached(stage, func, inputs, outputs, params):
+    """
+    Runs `func()` only if no artifact is cached for these inputs and params.
+
+    Parameters
+    ----------
+    stage : str
+        Stage name (e.g. "txt_to_csv"), used for the cache folder and stats.
+    func : callable
+        Zero-argument callable that does the work and writes `outputs`.
+    inputs : list[str]
+        Files the stage reads; their contents are hashed into the key.
+    outputs : list[str]
+        Files the stage writes.
+    params : dict
+        Call parameters that change the output.
+
+    Returns
+    -------
+    bool
+        True on a cache hit (work skipped, outputs restored from the cache),
+        False on a miss (work done, outputs stored in the cache).
+    """
+    key = cache_key(stage, inputs, params)
+    entry = os.path.join(CACHE_DIR, stage, key)
+    stored = [os.path.join(entry, f"out{i}") for i in range(len(outputs))]
+
+    # An entry directory only appears once it is complete (see below), so
+    # another process filling the same key is never read as a hit
+    if all(os.path.exists(p) for p in stored):
+        for src, dst in zip(stored, outputs):
+            if not os.path.exists(dst) or file_hash(dst) != file_hash(src):
+                _copy_atomic(src, dst)
+        _count(stage, "hits")
+        return True
+
+    func()
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix=f".{key}-")
+    try:
+        for src, name in zip(outputs, stored):
+            shutil.copyfile(src, os.path.join(tmp, os.path.basename(name)))
+        try:
+            os.replace(tmp, entry)
+        except OSError:
+            # A concurrent run stored the same key first; keep its entry
+            if not os.path.isdir(entry):
+                raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    _count(stage, "misses")
+    return False
+
+
+def invalidate_cache(stage=None):
+    """
+    Deletes cached artifacts so the next call rebuilds. Clears one stage if
+    `stage` is given, otherwise the whole cache.
+    """
+    target = CACHE_DIR if stage is None else os.path.join(CACHE_DIR, stage)
+    shutil.rmtree(target, ignore_errors=True)
+
+
+def cache_stats():
+    """
+    Returns hit/miss counts per stage since import (or the last reset).
+    """
+    return {stage: dict(counts) for stage, counts in _stats.items()}
+
+
+def reset_cache_stats():
+    _stats.clear()
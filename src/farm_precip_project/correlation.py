@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+
+from .cache import run_cached
+from .merge_csvs import merge_frames
+from .scrape_precip import CLIMDIV_COLS
+from .storage import read_table, write_table
+
+MONTHS = CLIMDIV_COLS[4:]
+
+# Precipitation windows: name -> months averaged. Single months are included
+# so monthly responses show up next to the seasonal ones.
+WINDOWS = {
+    "annual": MONTHS,
+    "growing_season": ["apr", "may", "jun", "jul", "aug", "sep"],
+    "spring": ["mar", "apr", "may"],
+    "summer": ["jun", "jul", "aug"],
+    **{m: [m] for m in MONTHS},
+}
+
+
+def _crop_columns(df):
+    from .scrape_farm import CROP_LABELS
+    return [c for c in CROP_LABELS if c in df.columns]
+
+
+def precip_features(dirty, windows=None, lags=(1, 2), groups=("state", "year")):
+    """
+    Builds per (state, year) precipitation features from the division-level
+    monthly table (rain_dirty.csv).
+
+    Valid division-months are summed once per (state, year, month); every
+    window mean is then one matrix product of those sums with a month x
+    window indicator matrix. Lagged copies (year t-1, t-2, ...) are looked
+    up by key, so gaps in the years give NaN rather than a shifted value.
+
+    Parameters
+    ----------
+    dirty : pd.DataFrame or str
+        Monthly table, or a path `read_table` can load.
+    windows : dict[str, list[str]] or None
+        Window name -> month columns. None uses WINDOWS.
+    lags : iterable of int
+        Extra lags to add, as "<window>_lag<k>" columns.
+    groups : tuple[str, str]
+        State and year key columns.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per (state, year), key columns first.
+    """
+    windows = WINDOWS if windows is None else windows
+    groups = list(groups)
+    months = list(dict.fromkeys(m for ms in windows.values() for m in ms))
+    if not isinstance(dirty, pd.DataFrame):
+        dirty = read_table(dirty, columns=groups + months)
+
+    values = dirty[months].to_numpy(dtype=np.float64, na_value=np.nan)
+    valid = ~np.isnan(values)
+    sums = pd.DataFrame(np.where(valid, values, 0.0)).groupby([dirty[g] for g in groups]).sum()
+    counts = pd.DataFrame(valid.astype(np.float64)).groupby([dirty[g] for g in groups]).sum()
+
+    pick = np.array([[m in ms for ms in windows.values()] for m in months], dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = (sums.to_numpy() @ pick) / (counts.to_numpy() @ pick)
+    feats = pd.DataFrame(means, index=sums.index, columns=list(windows))
+
+    parts = [feats]
+    for lag in lags:
+        lagged = feats.copy()
+        lagged.index = pd.MultiIndex.from_arrays(
+            [feats.index.get_level_values(0), feats.index.get_level_values(1) + lag], names=groups)
+        parts.append(lagged.reindex(feats.index).add_suffix(f"_lag{lag}"))
+    return pd.concat(parts, axis=1).reset_index()
+
+
+def correlation_matrix(df, rows, cols, center_by=None):
+    """
+    Pearson correlation of every column in `rows` with every column in
+    `cols`, using pairwise-complete observations like `DataFrame.corr`.
+
+    All pairs come out of a few matrix products of the (n, len(rows)) and
+    (n, len(cols)) blocks and their validity masks, instead of one `.corr()`
+    per pair.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Table holding both sets of columns, e.g. farm rows joined with
+        `precip_features`.
+    rows, cols : list[str]
+        Columns for the rows (e.g. crops) and columns (e.g. precipitation
+        features) of the result.
+    center_by : str or list[str] or None
+        If given, every column is first demeaned within these groups (as
+        `center_column` does), so the result is the within-state
+        correlation.
+
+    Returns
+    -------
+    pd.DataFrame
+        len(rows) x len(cols) matrix of r.
+    """
+    rows, cols = list(rows), list(cols)
+    data = df[list(dict.fromkeys(rows + cols))].astype(np.float64)
+    if center_by is not None:
+        data = data - data.groupby([df[g] for g in np.atleast_1d(center_by)]).transform("mean")
+    # A constant shift does not change r; centering first keeps the sums precise
+    data = data - data.mean()
+
+    Y = data[rows].to_numpy(na_value=np.nan)
+    X = data[cols].to_numpy(na_value=np.nan)
+    my, mx = (~np.isnan(Y)).astype(np.float64), (~np.isnan(X)).astype(np.float64)
+    Y0, X0 = np.nan_to_num(Y), np.nan_to_num(X)
+
+    n = my.T @ mx
+    sy, sx = Y0.T @ mx, my.T @ X0
+    syy = (Y0 * Y0).T @ mx - sy * sy / n
+    sxx = my.T @ (X0 * X0) - sx * sx / n
+    sxy = Y0.T @ X0 - sy * sx / n
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = np.clip(sxy / np.sqrt(syy * sxx), -1.0, 1.0)
+    r[n < 2] = np.nan
+    return pd.DataFrame(r, index=pd.Index(rows, name="crop"), columns=cols)
+
+
+def crop_precip_correlations(farm, dirty, out_name=None, crops=None, windows=None, lags=(1, 2),
+                             center_by=None, cache=False, storage=None):
+    """
+    Correlation of every crop column with every precipitation window and
+    lag: `precip_features` joined to the farm table, then
+    `correlation_matrix`.
+
+    Parameters
+    ----------
+    farm, dirty : str or pd.DataFrame
+        FarmIncome_full and rain_dirty tables or paths.
+    out_name : str or None
+        If given, the matrix is written there (crop names in a "crop"
+        column).
+    crops : list[str] or None
+        Crop columns. None uses every CROP_LABELS column in the farm table.
+    windows, lags
+        Passed to `precip_features`.
+    center_by : str or None
+        Passed to `correlation_matrix`; "state" gives within-state r.
+    cache : bool
+        Reuse the written matrix until the input files or arguments change
+        (needs paths and `out_name`).
+
+    Returns
+    -------
+    pd.DataFrame
+        Crop x feature matrix of r.
+    """
+    if cache:
+        if out_name is None or isinstance(farm, pd.DataFrame) or isinstance(dirty, pd.DataFrame):
+            raise ValueError("cache=True needs file paths for farm and dirty and an out_name")
+        result = {}
+        hit = run_cached(
+            "crop_precip_correlations",
+            lambda: result.setdefault("corr", crop_precip_correlations(
+                farm, dirty, out_name, crops, windows, lags, center_by, storage=storage)),
+            [farm, dirty], [out_name],
+            {"crops": crops, "windows": windows, "lags": list(lags), "center_by": center_by, "storage": storage},
+        )
+        return read_table(out_name, storage=storage).set_index("crop") if hit else result["corr"]
+
+    farm = farm if isinstance(farm, pd.DataFrame) else read_table(farm)
+    if crops is None:
+        crops = _crop_columns(farm)
+    feats = precip_features(dirty, windows, lags)
+    joined = merge_frames(farm[["state", "year"] + list(crops)], feats, ["state", "year"])
+    corr = correlation_matrix(joined, crops, [c for c in feats.columns if c not in ("state", "year")],
+                              center_by)
+    if out_name is not None:
+        write_table(corr.reset_index(), out_name, storage)
+    return corr
@@ -0,0 +1,180 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+# Retry on connection problems and on these HTTP statuses
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _meta_path(path):
+    return f"{path}.meta.json"
+
+
+def _load_meta(path):
+    try:
+        with open(_meta_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def download_file(url, path, session=None, chunk_size=1 << 16, retries=3, backoff=0.5, timeout=30):
+    """
+    Streams `url` to `path` in chunks, with retries, resume and conditional GET.
+
+    - If `path` was downloaded before, the stored ETag / Last-Modified are
+      sent (If-None-Match / If-Modified-Since); a 304 leaves the file alone.
+    - The body is written to `path + ".part"` and renamed when complete. If
+      a previous attempt left a partial file, the download resumes with a
+      Range request (restarting if the server ignores it).
+    - Connection errors and 429/5xx responses are retried `retries` times,
+      waiting backoff, 2*backoff, 4*backoff, ... seconds. A 416 to a resume
+      discards the partial file and uses up an attempt without waiting.
+    - Raises requests.HTTPError (or the connection error) once the last
+      attempt fails.
+
+    Returns
+    -------
+    str
+        "downloaded" or "unchanged".
+    """
+    session = session or requests.Session()
+    part = f"{path}.part"
+    meta = _load_meta(path) if os.path.exists(path) else {}
+
+    for attempt in range(retries + 1):
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        validator = _load_meta(part)
+        validator = validator.get("etag") or validator.get("last_modified")
+        if offset and validator:
+            # If-Range: the server sends the whole file again if it changed
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as r:
+                if r.status_code == 304:
+                    for stale in (part, _meta_path(part)):
+                        if os.path.exists(stale):
+                            os.remove(stale)
+                    return "unchanged"
+                if r.status_code in RETRY_STATUSES:
+                    raise requests.HTTPError(f"{r.status_code} from {url}", response=r)
+                if r.status_code == 416:
+                    # Stale partial file (e.g. the source changed); start over
+                    for stale in (part, _meta_path(part)):
+                        if os.path.exists(stale):
+                            os.remove(stale)
+                    if attempt == retries:
+                        raise requests.HTTPError(f"416 from {url} on the last attempt", response=r)
+                    continue
+                r.raise_for_status()
+
+                new_meta = {
+                    "url": url,
+                    "etag": r.headers.get("ETag"),
+                    "last_modified": r.headers.get("Last-Modified"),
+                }
+                if r.status_code == 206:
+                    mode = "ab"
+                else:
+                    mode = "wb"
+                    # Remember what the partial file belongs to, for resuming
+                    with open(_meta_path(part), "w") as f:
+                        json.dump(new_meta, f)
+                with open(part, mode) as f:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError,
+                requests.exceptions.ChunkedEncodingError) as e:
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            if isinstance(e, requests.HTTPError) and status not in RETRY_STATUSES:
+                raise
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+            continue
+
+        os.replace(part, path)
+        os.replace(_meta_path(part), _meta_path(path))
+        return "downloaded"
+
+
+def download_many(jobs, workers=4, on_complete=None, **kwargs):
+    """
+    Downloads several files concurrently on a thread pool.
+
+    Parameters
+    ----------
+    jobs : list[tuple[str, str]]
+        (url, path) pairs, e.g. the PDSI, PCP, TAVG and PHDI climdiv files.
+    workers : int
+        Number of concurrent downloads.
+    on_complete : callable or None
+        Called as on_complete(url, path, status) in the calling thread as
+        soon as each download finishes, while the others keep running.
+    **kwargs
+        Passed to `download_file` (retries, backoff, timeout, ...).
+
+    Returns
+    -------
+    dict[str, str]
+        path -> "downloaded" or "unchanged".
+    """
+    results = {}
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(download_file, url, path, session=session, **kwargs): (url, path)
+            for url, path in jobs
+        }
+        for future in as_completed(futures):
+            url, path = futures[future]
+            status = future.result()
+            results[path] = status
+            if on_complete is not None:
+                on_complete(url, path, status)
+    return results
+
+
+def refresh_txt_files(jobs, colspecs, cols, workers=4, force=False, **kwargs):
+    """
+    Downloads climdiv .txt files concurrently and converts each one with
+    `txt_to_csv` as soon as it finishes.
+
+    Parameters
+    ----------
+    jobs : list[tuple[str, str, str]]
+        (url, txt_name, csv_name) triples.
+    colspecs, cols : list
+        Passed to `txt_to_csv`.
+    workers : int
+        Number of concurrent downloads.
+    force : bool
+        Convert even when the .txt was unchanged and the .csv already exists.
+    **kwargs
+        Passed to `txt_to_csv` (engine, missing, storage, cache).
+
+    Returns
+    -------
+    dict[str, str]
+        txt_name -> "downloaded" or "unchanged".
+    """
+    from .scrape_precip import txt_to_csv
+
+    csv_for = {txt_name: csv_name for _, txt_name, csv_name in jobs}
+
+    def convert(url, txt_name, status):
+        csv_name = csv_for[txt_name]
+        if status == "downloaded" or force or not os.path.exists(csv_name):
+            txt_to_csv(txt_name, csv_name, colspecs, cols, **kwargs)
+
+    return download_many([(url, txt_name) for url, txt_name, _ in jobs], workers=workers,
+                         on_complete=convert)
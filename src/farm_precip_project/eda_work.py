@@ -1,6 +1,11 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from .correlation import correlation_matrix, _crop_columns
+from .render import draw_group_trend, draw_scatter, draw_group_means_scatter, draw_heatmap
+from .instrument import instrument
+
+@instrument
 def basic_summary(df):
     print(df.head())
     print(df.describe())
@@ -8,17 +13,14 @@ def basic_summary(df):
 
 group_by = "year"
 titles = ["Year", "Mean Normalized Precipitation", "Average Precipitation Across the U.S. Over Time"]
+@instrument
 def precip_trend_figure(df, group_by,titles):
-    mean_precip_by_year = df.groupby(group_by)["yearly_avg"].mean()
-    plt.figure(figsize=(12,6))
-    plt.plot(mean_precip_by_year)
-    plt.xlabel(titles[0])
-    plt.ylabel(titles[1])
-    plt.title(titles[2])
-    plt.tight_layout()
-    plt.savefig("plots/precip_over_time.png", dpi=300)
+    # Drawing lives in render.py so render_figures can batch the same plots
+    fig = plt.figure(figsize=(12,6))
+    draw_group_trend(fig, df, "yearly_avg", group_by, titles)
+    fig.savefig("plots/precip_over_time.png", dpi=300)
     #plt.close()
-    return plt.gcf()  # <- return the figure instead of saving
+    return fig  # <- return the figure instead of saving
 
     
 # group_by = "year"
@@ -37,56 +39,46 @@ def precip_trend_figure(df, group_by,titles):
 
 group_by2 = "year"
 titles2 = ["Year", "Mean Crop Cash Receipts", "Crop Income Trends Over Time"]
+@instrument
 def crop_income_fig(df, group_by2, titles2):
-    mean_income_by_year = df.groupby(group_by2)["Crop cash receipts"].mean()
-    plt.figure(figsize=(12,6))
-    plt.plot(mean_income_by_year)
-    plt.xlabel(titles2[0])
-    plt.ylabel(titles2[1])
-    plt.title(titles2[2])
-    plt.tight_layout()
-    plt.savefig("plots/crop_income_over_time.png", dpi=300)
+    fig = plt.figure(figsize=(12,6))
+    draw_group_trend(fig, df, "Crop cash receipts", group_by2, titles2)
+    fig.savefig("plots/crop_income_over_time.png", dpi=300)
     #plt.close()
-    return plt.gcf()
+    return fig
 
 
 title3 = ["Normalized Precipitation", "Crop Cash Receipts", "Relationship Between Precipitation and Crop Income"]
-def precip_v_income(df, title3):
-    plt.figure(figsize=(12,6))
-    plt.scatter(df["yearly_avg"], df["Crop cash receipts"], s=10)
-    plt.xlabel(title3[0])
-    plt.ylabel(title3[1])
-    plt.title(title3[2])
-    plt.tight_layout()
-    plt.savefig("plots/precip_vs_income_scatter.png", dpi=300)
-    plt.close()
+@instrument
+def precip_v_income(df, title3, mode="auto"):
+    # mode: "auto" switches to hexbin above render.SCATTER_POINT_LIMIT rows
+    fig = plt.figure(figsize=(12,6))
+    draw_scatter(fig, df, "yearly_avg", "Crop cash receipts", title3, s=10, mode=mode)
+    fig.savefig("plots/precip_vs_income_scatter.png", dpi=300)
+    plt.close(fig)
 
 group3 = "state"
 titlestate = ["Mean Normalized Precipitation", "Mean Crop Cash Receipts", "State-Level Comparison: Income vs Precipitation"]
+@instrument
 def statcompscatt(df, group3, titlestate):
-    state_summary = df.groupby(group3)[["yearly_avg", "Crop cash receipts"]].mean()
-    plt.figure(figsize=(12,6))
-    plt.scatter(state_summary["yearly_avg"], state_summary["Crop cash receipts"])
-    plt.xlabel(titlestate[0])
-    plt.ylabel(titlestate[1])
-    plt.title(titlestate[2])
-    plt.tight_layout()
-    plt.savefig("plots/state_level_precip_vs_income.png", dpi=300)
-    plt.close()
+    fig = plt.figure(figsize=(12,6))
+    draw_group_means_scatter(fig, df, group3, "yearly_avg", "Crop cash receipts", titlestate)
+    fig.savefig("plots/state_level_precip_vs_income.png", dpi=300)
+    plt.close(fig)
 
-def correl(df):
-    corr = df[["yearly_avg", "Crop cash receipts"]].corr()
+@instrument
+def correl(df, rows=None, cols=("yearly_avg",), center_by=None):
+    # rows default to every crop column in df; see correlation.correlation_matrix
+    corr = correlation_matrix(df, _crop_columns(df) if rows is None else rows, cols, center_by)
     print("\nCorrelation Matrix:\n", corr)
+    return corr
 
 titles = "Correlation Heatmap"
-def heatmap(df, title="Correlation Heatmap"):
-    corr = df[["yearly_avg", "Crop cash receipts"]].corr()
-    plt.figure(figsize=(6, 5))
-    plt.imshow(corr, vmin=-1, vmax=1)
-    plt.colorbar(label="Correlation")
-    plt.xticks([0, 1], ["Precip", "Income"])
-    plt.yticks([0, 1], ["Precip", "Income"])
-    plt.title(title)
-    plt.tight_layout()
-    plt.savefig("plots/correlation_heatmap.png", dpi=300)
-    plt.close()
\ No newline at end of file
+@instrument
+def heatmap(df=None, title="Correlation Heatmap", corr=None):
+    # Renders a crop x precipitation-feature matrix, e.g. from correl or
+    # crop_precip_correlations; computed from df only when corr is not given
+    fig = plt.figure()
+    draw_heatmap(fig, df, title, corr)
+    fig.savefig("plots/correlation_heatmap.png", dpi=300)
+    plt.close(fig)
@@ -0,0 +1,191 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from .merge_csvs import merge_frames
+from .scrape_precip import (
+    CLIMDIV_COLSPECS, CLIMDIV_COLS, CLIMDIV_MISSING,
+    _fixed_width_bytes, _parse_int_fields, _group_mean, parse_climdiv_lines,
+)
+from .storage import read_table, write_table
+
+# Incremental refresh: NOAA and USDA add a year per release, so instead of
+# rebuilding 1895-present, fingerprint every (state, year) key, compare with
+# the fingerprints saved next to each output (<output>.keys.csv), and only
+# parse, aggregate and upsert the keys that are new or changed.
+KEYS = ["state", "year"]
+
+
+def _keys_path(path):
+    return f"{path}.keys.csv"
+
+
+def _packed(state, year):
+    return np.asarray(state, dtype=np.int64) * 10_000 + np.asarray(year, dtype=np.int64)
+
+
+def _line_digests(state, year, buf):
+    """
+    One digest per (state, year): the first 8 bytes of the sha256 of that
+    key's lines (rows of the (n, width) byte array) in file order, plus the
+    line count. Unlike a per-line xor, reordering or duplicating lines
+    changes it.
+    """
+    key = _packed(state, year)
+    order = np.argsort(key, kind="stable")
+    uniq, starts = np.unique(key[order], return_index=True)
+    block = np.ascontiguousarray(buf[order])
+    bounds = np.append(starts, len(key))
+    digest = np.array([
+        int.from_bytes(hashlib.sha256(block[lo:hi].tobytes()).digest()[:8], "little", signed=True)
+        for lo, hi in zip(bounds[:-1], bounds[1:])
+    ], dtype=np.int64)
+    return pd.DataFrame({
+        "state": uniq // 10_000,
+        "year": uniq % 10_000,
+        "digest": digest,
+        "n_lines": np.diff(bounds),
+    })
+
+
+def _row_digests(df, prefix):
+    """One digest per row of a keyed table (the row's own content hash)."""
+    return pd.DataFrame({
+        "state": df["state"].to_numpy(dtype=np.int64),
+        "year": df["year"].to_numpy(dtype=np.int64),
+        # Nullable, so the outer join in refresh_combined does not go through float64
+        f"{prefix}_digest": pd.array(
+            pd.util.hash_pandas_object(df, index=False).to_numpy().view(np.int64), dtype="Int64"),
+    })
+
+
+def _load_digests(output_path):
+    keys_path = _keys_path(output_path)
+    if not (os.path.exists(output_path) and os.path.exists(keys_path)):
+        return None
+    return pd.read_csv(keys_path)
+
+
+def _diff_keys(new, old):
+    """
+    Compares two fingerprint tables. Returns (changed, removed) key frames:
+    keys that are new or whose fingerprint differs, and keys that are gone.
+    """
+    if old is None:
+        return new[KEYS], new[KEYS].iloc[:0]
+    both = new.merge(old, on=KEYS, how="outer", suffixes=("", "_old"), indicator=True)
+    fp = [c for c in new.columns if c not in KEYS]
+    differs = np.zeros(len(both), dtype=bool)
+    for c in fp:
+        differs |= (both[c] != both[f"{c}_old"]).to_numpy()
+    changed = both[(both["_merge"] == "left_only") | ((both["_merge"] == "both") & differs)]
+    removed = both[both["_merge"] == "right_only"]
+    return (changed[KEYS].astype(np.int64).reset_index(drop=True),
+            removed[KEYS].astype(np.int64).reset_index(drop=True))
+
+
+def upsert_table(path, rows, drop_keys, keys=KEYS, storage=None):
+    """
+    Replaces the rows of `path` whose keys are in `drop_keys` with `rows`
+    (creating the file if needed), keeping the table sorted by `keys`.
+    """
+    if os.path.exists(path):
+        existing = read_table(path, storage=storage, exact=True)
+        stale = pd.MultiIndex.from_frame(existing[keys].astype(np.int64)).isin(
+            pd.MultiIndex.from_frame(drop_keys[keys].astype(np.int64)))
+        rows = pd.concat([existing[~stale], rows[list(existing.columns)]], ignore_index=True)
+    rows = rows.sort_values(keys, kind="stable").reset_index(drop=True)
+    write_table(rows, path, storage)
+    return rows
+
+
+def refresh_rain_clean(txt_name, csv_name_clean, new_col_name="yearly_avg", colspecs=CLIMDIV_COLSPECS,
+                       cols=CLIMDIV_COLS, count_col="n_months", min_months=1, missing=CLIMDIV_MISSING,
+                       storage=None):
+    """
+    Brings `csv_name_clean` up to date with a climdiv .txt file, touching
+    only the (state, year) keys whose lines are new or changed.
+
+    The raw lines of each key are hashed straight from the bytes (no
+    parsing) into one fingerprint per key, which is compared with the
+    fingerprints saved at the last refresh. Only the lines of changed keys
+    are parsed and averaged, with the same rules as
+    txt_to_csv + normalized_data, and then upserted. The first call (no
+    saved fingerprints) builds the whole table.
+
+    Returns
+    -------
+    tuple[pd.DataFrame, pd.DataFrame]
+        (changed, removed) state/year keys.
+    """
+    width = max(end for _, end in colspecs)
+    spans = dict(zip(cols, colspecs))
+    buf = _fixed_width_bytes(txt_name, width)
+    state = _parse_int_fields(buf[:, slice(*spans["state"])])
+    year = _parse_int_fields(buf[:, slice(*spans["year"])])
+
+    digests = _line_digests(state, year, buf)
+    changed, removed = _diff_keys(digests, _load_digests(csv_name_clean))
+
+    if len(changed) or len(removed) or not os.path.exists(csv_name_clean):
+        # Parse and aggregate only the lines of changed keys (float64, as in
+        # the CSV pipeline, so values match a full rebuild exactly)
+        sel = np.isin(_packed(state, year), _packed(changed["state"], changed["year"]))
+        df = parse_climdiv_lines(buf[sel], colspecs, cols, missing, dtype=np.float64)
+        rows = _group_mean(df, new_col_name, cols[4:], KEYS, count_col, min_months).reset_index()
+        upsert_table(csv_name_clean, rows, pd.concat([changed, removed]), storage=storage)
+
+    digests.to_csv(_keys_path(csv_name_clean), index=False)
+    return changed, removed
+
+
+def refresh_combined(farm_path, clean_path, combined_path, storage=None):
+    """
+    Brings the merged table up to date, re-merging only the (state, year)
+    keys whose farm row or precipitation row is new, changed or gone since
+    the last refresh. The first call builds the whole table.
+
+    Returns
+    -------
+    tuple[pd.DataFrame, pd.DataFrame]
+        (changed, removed) state/year keys.
+    """
+    farm = read_table(farm_path)
+    clean = read_table(clean_path)
+    digests = _row_digests(farm, "farm").merge(_row_digests(clean, "rain"), on=KEYS, how="outer")
+    # Missing on one side is a state too; mark it so it compares equal
+    digests = digests.fillna(0).astype(np.int64)
+    changed, removed = _diff_keys(digests, _load_digests(combined_path))
+
+    if len(changed) or len(removed) or not os.path.exists(combined_path):
+        wanted = pd.MultiIndex.from_frame(changed)
+        farm_rows = farm[pd.MultiIndex.from_frame(farm[KEYS].astype(np.int64)).isin(wanted)]
+        clean_rows = clean[pd.MultiIndex.from_frame(clean[KEYS].astype(np.int64)).isin(wanted)]
+        rows = merge_frames(farm_rows.reset_index(drop=True), clean_rows.reset_index(drop=True), KEYS)
+        upsert_table(combined_path, rows, pd.concat([changed, removed]), storage=storage)
+
+    digests.to_csv(_keys_path(combined_path), index=False)
+    return changed, removed
+
+
+def incremental_refresh(txt_name, clean_path, farm_path=None, combined_path=None, **kwargs):
+    """
+    Runs `refresh_rain_clean` and then, if `farm_path` and `combined_path`
+    are given, `refresh_combined`. Extra keyword arguments go to
+    `refresh_rain_clean`.
+
+    Returns
+    -------
+    dict
+        Number of changed and removed keys for each output.
+    """
+    changed, removed = refresh_rain_clean(txt_name, clean_path, **kwargs)
+    summary = {"rain_changed": len(changed), "rain_removed": len(removed)}
+    if farm_path is not None and combined_path is not None:
+        changed, removed = refresh_combined(farm_path, clean_path, combined_path,
+                                            storage=kwargs.get("storage"))
+        summary.update(combined_changed=len(changed), combined_removed=len(removed))
+    print(", ".join(f"{k}: {v}" for k, v in summary.items()))
+    return summary
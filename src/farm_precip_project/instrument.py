@@ -0,0 +1,372 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+from .cache import CACHE_DIR
+
+# Opt-in per-call instrumentation for the pipeline functions. Functions are
+# wrapped with `@instrument` where they are defined; while instrumentation
+# is off the wrapper is a single flag check before the real call. When it
+# is on, every call records:
+#   wall_s, cpu_s         - perf_counter / thread_time deltas
+#   peak_rss_mb           - peak resident memory during the call (Linux;
+#                           elsewhere the process peak so far); None when
+#                           another thread had a recorded call open
+#   alloc_peak_mb         - peak traced allocations above the starting
+#                           level, with memory="tracemalloc"
+#   rows_in, rows_out     - rows of DataFrame arguments plus rows read with
+#                           `read_table`; rows of a returned DataFrame, else
+#                           rows written with `write_table`
+#   bytes_read, bytes_written - from /proc/thread-self/io (Linux only)
+# Nested calls (merge_csvs -> merge_frames) get their own records with
+# depth and parent set. Records go to an in-process list and, if a trace
+# path is given, to a JSON-lines file. Setting FPP_TRACE=<path> turns it on
+# at import.
+#
+# The on/off switch and the records are shared by the whole process, but
+# each thread keeps its own call stack, so calls made at the same time from
+# several threads (e.g. Streamlit sessions) get the right depth and parent.
+# CPU seconds and byte counts are those of the calling thread; work the call
+# hands to helper threads is not included. Peak RSS only exists per process:
+# resetting it would wipe the peak of the other threads' calls, and their
+# spikes would be charged to this one, so while calls from more than one
+# thread overlap no reset is made and peak_rss_mb is left empty. The
+# tracemalloc peak is still recorded then, but also counts allocations the
+# other threads made during the call.
+
+_enabled = False
+
+_state = {
+    "trace": None,
+    "memory": "rss",
+    "profile": None,
+    "profile_dir": os.path.join(CACHE_DIR, "profiles"),
+    "file": None,
+    "pid": None,
+    "started_tracemalloc": False,
+}
+_records = []
+# Recorded calls open in any thread, to tell when calls overlap
+_open_frames = []
+# Guards _records, _open_frames, the trace file and the switch
+_lock = threading.RLock()
+_local = threading.local()
+
+
+def _after_fork():
+    # Only the forking thread lives on in a worker process: drop the other
+    # threads' open calls and a lock one of them may have held
+    global _lock
+    _lock = threading.RLock()
+    me = threading.get_ident()
+    _open_frames[:] = [f for f in _open_frames if f["thread"] == me]
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _call_stack():
+    # This thread's open calls, outermost first
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+# ---------------------------------------------------------
+# Process counters
+# ---------------------------------------------------------
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None if unknown."""
+    # VmHWM belongs to this process image; ru_maxrss on Linux also carries
+    # the peak of the parent that forked it
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def reset_peak_rss():
+    """Resets the peak to the current RSS where the kernel allows it (Linux)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _io_bytes():
+    # rchar/wchar count bytes passed to read/write calls, cached or not; the
+    # per-thread file needs Linux 3.17, older kernels only have the process one
+    for path in ("/proc/thread-self/io", "/proc/self/io"):
+        try:
+            with open(path) as f:
+                fields = dict(line.split(":") for line in f)
+            return int(fields["rchar"]), int(fields["wchar"])
+        except FileNotFoundError:
+            continue
+        except (OSError, KeyError, ValueError):
+            return None
+    return None
+
+
+# ---------------------------------------------------------
+# Switching on and off
+# ---------------------------------------------------------
+def enable_instrumentation(trace=None, memory="rss", profile=None, profile_dir=None):
+    """
+    Turns on per-call instrumentation.
+
+    Parameters
+    ----------
+    trace : str or None
+        JSON-lines file to append one record per call to. None keeps the
+        records in memory only (see `instrumentation_summary`).
+    memory : str
+        "rss" (cheap: peak resident memory of the process) or
+        "tracemalloc" (also the peak of Python and NumPy allocations per
+        call; slows allocation-heavy code down noticeably). The RSS peak is
+        left empty for calls that overlap a recorded call in another
+        thread, so only "tracemalloc" gives a per-call memory figure under
+        concurrency (one that includes the other threads' allocations).
+    profile : bool, str, iterable of str, or None
+        Run matching calls under cProfile: True for every outermost call, or
+        function names such as "merge_csvs" or
+        ["merge_csvs", "build_farm_frame"]. Stats
+        are written to `profile_dir` and the file is named in the record.
+    profile_dir : str or None
+        Where .prof files go; defaults to <CACHE_DIR>/profiles.
+    """
+    global _enabled
+    if memory not in ("rss", "tracemalloc"):
+        raise ValueError(f"memory must be 'rss' or 'tracemalloc', not {memory!r}")
+    with _lock:
+        disable_instrumentation()
+        if isinstance(profile, str):
+            profile = {profile}
+        _state.update(trace=trace, memory=memory,
+                      profile=profile if profile in (None, True) else set(profile))
+        if profile_dir is not None:
+            _state["profile_dir"] = profile_dir
+        if memory == "tracemalloc":
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _state["started_tracemalloc"] = True
+        _enabled = True
+
+
+def disable_instrumentation():
+    """
+    Turns instrumentation off for the whole process. Records collected so
+    far are kept.
+    """
+    global _enabled
+    with _lock:
+        _enabled = False
+        if _state["file"] is not None:
+            _state["file"].close()
+            _state["file"] = None
+        if _state["started_tracemalloc"]:
+            import tracemalloc
+            tracemalloc.stop()
+            _state["started_tracemalloc"] = False
+        _state["memory"] = "rss"
+
+
+def instrumentation_enabled():
+    return _enabled
+
+
+def reset_instrumentation():
+    """Drops the in-process records."""
+    with _lock:
+        _records.clear()
+
+
+def instrumentation_records():
+    """The in-process records, oldest first, as a list of dicts."""
+    with _lock:
+        return list(_records)
+
+
+def instrumentation_summary(records=None):
+    """
+    Per-function totals of the records (default: the in-process ones).
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per function: calls, total/mean/max wall seconds, CPU
+        seconds, max peak RSS, rows and bytes, slowest first.
+    """
+    import pandas as pd
+
+    df = pd.DataFrame(instrumentation_records() if records is None else records)
+    if df.empty:
+        return pd.DataFrame(columns=["func", "calls", "wall_s", "mean_wall_s", "max_wall_s", "cpu_s",
+                                     "peak_rss_mb", "rows_in", "rows_out", "bytes_read", "bytes_written"])
+    summary = df.groupby("func").agg(
+        calls=("wall_s", "size"),
+        wall_s=("wall_s", "sum"),
+        mean_wall_s=("wall_s", "mean"),
+        max_wall_s=("wall_s", "max"),
+        cpu_s=("cpu_s", "sum"),
+        peak_rss_mb=("peak_rss_mb", "max"),
+        rows_in=("rows_in", "sum"),
+        rows_out=("rows_out", "sum"),
+        bytes_read=("bytes_read", "sum"),
+        bytes_written=("bytes_written", "sum"),
+    )
+    return summary.sort_values("wall_s", ascending=False).reset_index()
+
+
+# ---------------------------------------------------------
+# Recording
+# ---------------------------------------------------------
+def add_rows(rows_in=0, rows_out=0):
+    """Credits rows read or written (by `read_table` / `write_table`) to every open call of this thread."""
+    if not _enabled:
+        return
+    for frame in _call_stack():
+        frame["read"] += rows_in
+        frame["written"] += rows_out
+
+
+def _rows(value):
+    return len(value) if hasattr(value, "columns") and hasattr(value, "index") else 0
+
+
+def _write(record):
+    with _lock:
+        _records.append(record)
+        if _state["trace"] is None:
+            return
+        # Reopen after a fork so worker processes do not share a buffer
+        if _state["file"] is None or _state["pid"] != os.getpid():
+            _state["file"] = open(_state["trace"], "a")
+            _state["pid"] = os.getpid()
+        _state["file"].write(json.dumps(record) + "\n")
+        _state["file"].flush()
+
+
+def _profiler_for(name, stack):
+    profile = _state["profile"]
+    if profile is None or any(f["profiler"] is not None for f in stack):
+        return None
+    if profile is True and stack:
+        return None
+    if profile is not True and name not in profile:
+        return None
+    import cProfile
+    return cProfile.Profile()
+
+
+def _instrumented_call(func, args, kwargs):
+    stack = _call_stack()
+    tracing = _state["memory"] == "tracemalloc"
+    if tracing:
+        import tracemalloc
+        # The parent keeps the peak it reached before this call
+        if stack:
+            stack[-1]["alloc_peak"] = max(stack[-1]["alloc_peak"], tracemalloc.get_traced_memory()[1])
+        alloc_start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    if stack:
+        stack[-1]["rss_peak"] = max(stack[-1]["rss_peak"], peak_rss_mb() or 0.0)
+
+    name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__qualname__}"
+    parent = stack[-1]["name"] if stack else None
+    frame = {"name": name, "written": 0, "alloc_peak": 0, "rss_peak": 0.0, "shared": False,
+             "thread": threading.get_ident(),
+             "read": sum(_rows(a) for a in args) + sum(_rows(v) for v in kwargs.values()),
+             "profiler": _profiler_for(func.__name__, stack)}
+    with _lock:
+        others = [f for f in _open_frames if f["thread"] != frame["thread"]]
+        if others:
+            # The process peak now mixes both threads' calls, for as long as they run
+            for f in others + [frame]:
+                f["shared"] = True
+        _open_frames.append(frame)
+    if not frame["shared"]:
+        reset_peak_rss()
+    stack.append(frame)
+    io_start = _io_bytes()
+    start, cpu, wall_clock = time.perf_counter(), time.thread_time(), time.time()
+    error = None
+    try:
+        if frame["profiler"] is not None:
+            result = frame["profiler"].runcall(func, *args, **kwargs)
+        else:
+            result = func(*args, **kwargs)
+        return result
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        result = None
+        raise
+    finally:
+        wall, cpu = time.perf_counter() - start, time.thread_time() - cpu
+        io_end = _io_bytes()
+        stack.pop()
+        with _lock:
+            # By identity: two open frames can compare equal
+            del _open_frames[next(i for i, f in enumerate(_open_frames) if f is frame)]
+        rss_peak = None if frame["shared"] else max(frame["rss_peak"], peak_rss_mb() or 0.0) or None
+        record = {
+            "func": name,
+            "start": wall_clock,
+            "wall_s": wall,
+            "cpu_s": cpu,
+            "peak_rss_mb": rss_peak,
+            "alloc_peak_mb": None,
+            "rows_in": frame["read"],
+            "rows_out": _rows(result) or frame["written"],
+            "bytes_read": None if io_start is None else io_end[0] - io_start[0],
+            "bytes_written": None if io_start is None else io_end[1] - io_start[1],
+            "depth": len(stack),
+            "parent": parent,
+            "pid": os.getpid(),
+            "error": error,
+            "profile": None,
+        }
+        if tracing:
+            alloc_peak = max(frame["alloc_peak"], tracemalloc.get_traced_memory()[1])
+            record["alloc_peak_mb"] = (alloc_peak - alloc_start) / 2 ** 20
+            if stack:
+                stack[-1]["alloc_peak"] = max(stack[-1]["alloc_peak"], alloc_peak)
+        if stack:
+            stack[-1]["rss_peak"] = max(stack[-1]["rss_peak"], rss_peak or 0.0)
+        if frame["profiler"] is not None:
+            os.makedirs(_state["profile_dir"], exist_ok=True)
+            path = os.path.join(_state["profile_dir"], f"{func.__name__}-{os.getpid()}-{int(wall_clock * 1000)}.prof")
+            frame["profiler"].dump_stats(path)
+            record["profile"] = path
+        _write(record)
+
+
+def instrument(func):
+    """Decorator: records each call of `func` while instrumentation is enabled."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        return _instrumented_call(func, args, kwargs)
+    return wrapper
+
+
+if os.environ.get("FPP_TRACE"):
+    enable_instrumentation(trace=os.environ["FPP_TRACE"])
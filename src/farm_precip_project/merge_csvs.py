@@ -1,7 +1,104 @@
+import os
+
+import numpy as np
 import pandas as pd
 
-def merge_csvs(new_csv_name, csvs, group_on):
-    df1 = pd.read_csv(csvs[0])
-    df2 = pd.read_csv(csvs[1])
-    merged_df = pd.merge(df1, df2, on=group_on)
-    merged_df.to_csv(new_csv_name, index=False)
\ No newline at end of file
+from .cache import run_cached
+from .instrument import instrument
+from .storage import read_table, write_table
+
+@instrument
+def merge_csvs(new_csv_name, csvs, group_on, cache=False, storage=None, fast=True):
+    """
+    Merges two tables on `group_on` and returns the merged DataFrame.
+
+    `csvs` holds two DataFrames or file paths (any format `read_table`
+    reads). The result is written to `new_csv_name` only if it is not
+    None, so callers that just need the frame skip the write and the
+    re-read. `fast` uses the packed-key join in `merge_frames`.
+    """
+    if cache:
+        if new_csv_name is None or not all(isinstance(c, (str, os.PathLike)) for c in csvs):
+            raise ValueError("cache=True needs file paths in csvs and an output file name")
+        result = {}
+        hit = run_cached(
+            "merge_csvs",
+            lambda: result.setdefault(
+                "df", merge_csvs(new_csv_name, csvs, group_on, storage=storage, fast=fast)),
+            list(csvs), [new_csv_name], {"group_on": group_on, "storage": storage},
+        )
+        return read_table(new_csv_name, storage=storage) if hit else result["df"]
+    df1, df2 = (c if isinstance(c, pd.DataFrame) else read_table(c) for c in csvs)
+    merged_df = merge_frames(df1, df2, group_on, fast=fast)
+    if new_csv_name is not None:
+        write_table(merged_df, new_csv_name, storage)
+    return merged_df
+
+
+def _packed_keys(frames, group_on):
+    """
+    Packs integer key columns (e.g. state, year) into one int64 per row,
+    using the combined range of both frames. Returns None if the packed
+    key would not fit in int64.
+    """
+    lows, spans = [], []
+    for col in group_on:
+        lo = min(int(f[col].min()) for f in frames)
+        hi = max(int(f[col].max()) for f in frames)
+        lows.append(lo)
+        spans.append(hi - lo + 1)
+    if np.prod(spans, dtype=float) >= 2 ** 62:
+        return None
+
+    keys = []
+    for f in frames:
+        key = np.zeros(len(f), dtype=np.int64)
+        for col, lo, span in zip(group_on, lows, spans):
+            key = key * span + (f[col].to_numpy(dtype=np.int64) - lo)
+        keys.append(key)
+    return keys, int(np.prod(spans))
+
+
+@instrument
+def merge_frames(left, right, group_on, fast=True):
+    """
+    Inner join of `left` and `right` on `group_on`, same result as
+    `pd.merge(left, right, on=group_on)`.
+
+    With `fast=True` and NumPy int64 keys that are unique in `right` (the
+    (state, year) panel), the keys are packed into one int64 and joined
+    by direct lookup. A dense key range uses a flat position table;
+    otherwise a hash index is used. Anything else falls back to
+    `pd.merge`.
+    """
+    group_on = [group_on] if isinstance(group_on, str) else list(group_on)
+    overlap = (set(left.columns) & set(right.columns)) - set(group_on)
+    # Only plain NumPy int64 keys: nullable Int64 columns may hold <NA>,
+    # which cannot be packed (pd.merge matches <NA> to <NA>)
+    usable = (
+        fast and not overlap and len(left) and len(right)
+        and all(left[c].dtype == np.int64 and right[c].dtype == np.int64 for c in group_on)
+    )
+    packed = _packed_keys([left, right], group_on) if usable else None
+    if packed is None:
+        return pd.merge(left, right, on=group_on)
+
+    (lkey, rkey), n_keys = packed
+    if n_keys <= 4 * (len(left) + len(right)) + 1024:
+        # Dense key space: key -> row position table
+        if np.bincount(rkey, minlength=n_keys).max() > 1:
+            return pd.merge(left, right, on=group_on)
+        table = np.full(n_keys, -1, dtype=np.int64)
+        table[rkey] = np.arange(len(rkey))
+        pos = table[lkey]
+    else:
+        index = pd.Index(rkey)
+        if not index.is_unique:
+            return pd.merge(left, right, on=group_on)
+        pos = index.get_indexer(lkey)
+
+    # Inner join keeps left rows (in left order) that found a match
+    keep = pos >= 0
+    out = left[keep].reset_index(drop=True)
+    extra = right.drop(columns=group_on).iloc[pos[keep]].reset_index(drop=True)
+    return pd.concat([out, extra], axis=1)
@@ -0,0 +1,178 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# On-disk layout of a panel directory:
+#   values.npy   (n_columns, n_states, n_years) array, one contiguous block per column
+#   present.npy  (n_states, n_years) bool, True where the source had a row
+#   meta.json    column names, state ids, first year, key column names
+PANEL_VERSION = 1
+
+
+def write_panel(df, path, columns=None, state_col="state", year_col="year", dtype=np.float32):
+    """
+    Writes a state x year table as a dense, memory-mappable panel.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Long table with one row per (state, year), e.g. the merged dataset.
+    path : str
+        Directory to write (created if needed).
+    columns : list[str] or None
+        Value columns to store. None stores every column except the keys.
+    state_col, year_col : str
+        Key columns. Years are stored as a contiguous range.
+    dtype : numpy dtype
+        Storage type of the values. float32 halves the size of float64 and
+        keeps about 7 significant digits (income in $1,000 above ~1e7 is
+        rounded to a few units); pass np.float64 to keep values exact.
+    """
+    if columns is None:
+        columns = [c for c in df.columns if c not in (state_col, year_col)]
+    if df.duplicated([state_col, year_col]).any():
+        raise ValueError(f"{state_col}/{year_col} pairs must be unique to build a panel")
+
+    state_ids = df[state_col].to_numpy()
+    year_ids = df[year_col].to_numpy()
+    states = np.unique(state_ids)
+    year_start = int(year_ids.min())
+    n_years = int(year_ids.max()) - year_start + 1
+    s_pos = np.searchsorted(states, state_ids)
+    y_pos = year_ids - year_start
+
+    os.makedirs(path, exist_ok=True)
+    values = np.lib.format.open_memmap(
+        os.path.join(path, "values.npy"), mode="w+", dtype=dtype,
+        shape=(len(columns), len(states), n_years),
+    )
+    values[:] = np.nan
+    for i, col in enumerate(columns):
+        values[i, s_pos, y_pos] = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+    values.flush()
+    del values
+
+    present = np.zeros((len(states), n_years), dtype=bool)
+    present[s_pos, y_pos] = True
+    np.save(os.path.join(path, "present.npy"), present)
+
+    meta = {
+        "version": PANEL_VERSION,
+        "columns": list(columns),
+        "states": states.tolist(),
+        "year_start": year_start,
+        "state_col": state_col,
+        "year_col": year_col,
+    }
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+
+class PanelStore:
+    """
+    Read-only view of a panel written by `write_panel`.
+
+    The value array is opened with `numpy.memmap` (via np.load's mmap_mode),
+    so every process that opens the same file shares the OS page cache
+    instead of holding its own parsed copy.
+
+    `select` returns a view, not a copy, whenever each selector is a single
+    value or a contiguous range: one column or neighbouring columns, one
+    state or a (first, last) range of state ids, one year or a (first, last)
+    range of years.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["version"] != PANEL_VERSION:
+            raise ValueError(f"unsupported panel version {meta['version']}")
+        self.path = path
+        self.columns = meta["columns"]
+        self.states = np.asarray(meta["states"])
+        self.state_col = meta["state_col"]
+        self.year_col = meta["year_col"]
+        self.values = np.load(os.path.join(path, "values.npy"), mmap_mode="r")
+        self.present = np.load(os.path.join(path, "present.npy"), mmap_mode="r")
+        self.years = np.arange(meta["year_start"], meta["year_start"] + self.values.shape[2])
+
+    def _column_index(self, columns):
+        if columns is None:
+            return slice(None)
+        if isinstance(columns, str):
+            return self.columns.index(columns)
+        pos = [self.columns.index(c) for c in columns]
+        if pos and pos == list(range(pos[0], pos[0] + len(pos))):
+            return slice(pos[0], pos[0] + len(pos))
+        return pos
+
+    def _state_index(self, states):
+        if states is None:
+            return slice(None)
+        if isinstance(states, tuple):
+            first, last = states
+            return slice(np.searchsorted(self.states, first, side="left"),
+                         np.searchsorted(self.states, last, side="right"))
+        pos = np.searchsorted(self.states, states)
+        if pos >= len(self.states) or self.states[pos] != states:
+            raise KeyError(f"state {states} is not in the panel")
+        return int(pos)
+
+    def _year_index(self, years):
+        if years is None:
+            return slice(None)
+        start = int(self.years[0])
+        if isinstance(years, tuple):
+            first, last = years
+            return slice(max(first - start, 0), max(last - start + 1, 0))
+        if not start <= years <= self.years[-1]:
+            raise KeyError(f"year {years} is not in the panel")
+        return int(years - start)
+
+    def select(self, columns=None, states=None, years=None):
+        """
+        Returns the values for the selected columns, states and years.
+
+        Parameters
+        ----------
+        columns : str, list[str] or None
+            A column name (drops the column axis) or a list of names.
+        states : int, tuple[int, int] or None
+            A state id (drops the state axis) or an inclusive (first, last)
+            range of ids.
+        years : int, tuple[int, int] or None
+            A year (drops the year axis) or an inclusive (first, last) range.
+
+        Returns
+        -------
+        np.ndarray
+            Axes in (column, state, year) order, minus any dropped axis.
+        """
+        return self.values[self._column_index(columns), self._state_index(states), self._year_index(years)]
+
+    def to_frame(self, columns=None, states=None, years=None):
+        """
+        Copies a selection back into a long DataFrame with one row per
+        (state, year) that existed in the source table.
+        """
+        names = [columns] if isinstance(columns, str) else (self.columns if columns is None else list(columns))
+        s_idx = self._state_index(states if states is None or isinstance(states, tuple) else (states, states))
+        y_idx = self._year_index(years if years is None or isinstance(years, tuple) else (years, years))
+        block = self.values[self._column_index(names), s_idx, y_idx]
+        mask = np.asarray(self.present[s_idx, y_idx])
+
+        s_grid, y_grid = np.nonzero(mask)
+        out = pd.DataFrame({
+            self.state_col: self.states[s_idx][s_grid],
+            self.year_col: self.years[y_idx][y_grid],
+        })
+        for i, name in enumerate(names):
+            out[name] = block[i][mask]
+        return out
+
+
+def open_panel(path):
+    """Opens a panel directory written by `write_panel`."""
+    return PanelStore(path)
@@ -0,0 +1,310 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# The end-to-end pipeline as a DAG of stages. Each stage is a dict:
+#   name     - unique stage name
+#   func     - module-level function (so it can run in a worker process)
+#   kwargs   - keyword arguments for func
+#   inputs   - files the stage reads
+#   outputs  - files the stage writes
+# A stage depends on whichever stage writes one of its inputs; inputs no
+# stage writes are source files and must exist. Stages whose dependencies
+# are done run concurrently, and a stage is skipped when all its outputs
+# exist and are newer than all its inputs. Stages with no inputs (the
+# download) always run and decide for themselves whether anything changed.
+
+NOAA_PDSI_URL = "https://www.ncei.noaa.gov/pub/data/cirs/drd/drd964x.pdsi.txt"
+
+# Every path the pipeline touches. File formats follow the extensions (see
+# `storage_format`), e.g. "rain_clean.parquet".
+DEFAULT_CONFIG = {
+    "url": NOAA_PDSI_URL,
+    "txt_name": "rain.txt",
+    "dirty_path": "rain_dirty.csv",
+    "clean_path": "rain_clean.csv",
+    "farm_path": "FarmIncome.xlsx",
+    "va_path": "VA_State_US (1).xlsx",
+    "farm_out": "FarmIncome_full.csv",
+    "combined_path": "combined_farm_precip.csv",
+    "engine": "fwf",
+    "reader": "stream",
+    "figures": True,
+}
+
+
+def load_config(config=None):
+    """
+    DEFAULT_CONFIG updated with `config`: a dict, a JSON file path, or None.
+
+    Unknown keys raise ValueError so a misspelt path is not silently ignored.
+    """
+    if isinstance(config, (str, os.PathLike)):
+        with open(config) as f:
+            config = json.load(f)
+    config = dict(config or {})
+    unknown = set(config) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError(f"unknown pipeline config keys: {sorted(unknown)}")
+    return {**DEFAULT_CONFIG, **config}
+
+
+# ---------------------------------------------------------
+# Stage functions
+# ---------------------------------------------------------
+def _download(url, path):
+    from .download import download_file
+    print(f"{path}: {download_file(url, path)}")
+
+
+def _merge(new_csv_name, csvs, group_on):
+    from .merge_csvs import merge_csvs
+    # Return nothing: the frame would otherwise be pickled back from a worker
+    merge_csvs(new_csv_name, csvs, group_on)
+
+
+def _figures(data):
+    from .render import render_figures, site_figures
+    render_figures(site_figures(data))
+
+
+def pipeline_stages(config=None):
+    """
+    The pipeline's stages for `config` (see DEFAULT_CONFIG):
+
+    download -> txt_to_csv -> normalized_data --+
+                                                +--> merge_csvs -> figures
+    scrape_farm_data ---------------------------+
+
+    With "url": None there is no download stage and "txt_name" must exist;
+    with "figures": False there is no figures stage.
+    """
+    from .render import site_figures
+    from .scrape_farm import scrape_farm_data
+    from .scrape_precip import CLIMDIV_COLS, CLIMDIV_COLSPECS, normalized_data, txt_to_csv
+
+    c = load_config(config)
+    stages = []
+    if c["url"]:
+        stages.append({"name": "download", "func": _download,
+                       "kwargs": {"url": c["url"], "path": c["txt_name"]},
+                       "inputs": [], "outputs": [c["txt_name"]]})
+    stages += [
+        {"name": "txt_to_csv", "func": txt_to_csv,
+         "kwargs": {"txt_name": c["txt_name"], "csv_name": c["dirty_path"], "colspecs": CLIMDIV_COLSPECS,
+                    "cols": CLIMDIV_COLS, "engine": c["engine"]},
+         "inputs": [c["txt_name"]], "outputs": [c["dirty_path"]]},
+        {"name": "normalized_data", "func": normalized_data,
+         "kwargs": {"df_to_read": c["dirty_path"], "new_col_name": "yearly_avg",
+                    "csv_name_clean": c["clean_path"], "months": CLIMDIV_COLS[4:], "groups": ["state", "year"]},
+         "inputs": [c["dirty_path"]], "outputs": [c["clean_path"]]},
+        {"name": "scrape_farm_data", "func": scrape_farm_data,
+         "kwargs": {"reader": c["reader"], "farm_path": c["farm_path"], "va_path": c["va_path"],
+                    "output_path": c["farm_out"]},
+         "inputs": [c["farm_path"], c["va_path"]], "outputs": [c["farm_out"]]},
+        {"name": "merge_csvs", "func": _merge,
+         "kwargs": {"new_csv_name": c["combined_path"], "csvs": [c["farm_out"], c["clean_path"]],
+                    "group_on": ["state", "year"]},
+         "inputs": [c["farm_out"], c["clean_path"]], "outputs": [c["combined_path"]]},
+    ]
+    if c["figures"]:
+        stages.append({"name": "figures", "func": _figures, "kwargs": {"data": c["combined_path"]},
+                       "inputs": [c["combined_path"]],
+                       "outputs": [spec["out"] for spec in site_figures(c["combined_path"])]})
+    return stages
+
+
+# ---------------------------------------------------------
+# Scheduling
+# ---------------------------------------------------------
+def stage_graph(stages):
+    """
+    Maps each stage name to the names of the stages it depends on.
+
+    Raises ValueError for duplicate names, two stages writing the same
+    file, or a cycle.
+    """
+    names = [s["name"] for s in stages]
+    if len(set(names)) != len(names):
+        raise ValueError(f"duplicate stage names in {names}")
+    producer = {}
+    for s in stages:
+        for out in s["outputs"]:
+            if out in producer:
+                raise ValueError(f"{out!r} is written by both {producer[out]!r} and {s['name']!r}")
+            producer[out] = s["name"]
+    deps = {s["name"]: sorted({producer[i] for i in s["inputs"] if i in producer} - {s["name"]})
+            for s in stages}
+
+    # Kahn's algorithm, only to find cycles
+    remaining = {name: set(d) for name, d in deps.items()}
+    while remaining:
+        ready = [name for name, d in remaining.items() if not d]
+        if not ready:
+            raise ValueError(f"stage dependencies form a cycle among {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for d in remaining.values():
+            d.difference_update(ready)
+    return deps
+
+
+def _up_to_date(stage):
+    if not stage["inputs"] or not all(os.path.exists(p) for p in stage["outputs"]):
+        return False
+    newest_input = max(os.path.getmtime(p) for p in stage["inputs"])
+    return min(os.path.getmtime(p) for p in stage["outputs"]) >= newest_input
+
+
+def _timed_call(func, kwargs):
+    start = time.perf_counter()
+    func(**kwargs)
+    return time.perf_counter() - start
+
+
+def run_pipeline(config=None, targets=None, force=False, workers=None, dry_run=False, stages=None):
+    """
+    Runs the pipeline, skipping stages whose outputs are up to date.
+
+    Parameters
+    ----------
+    config : dict, str or None
+        Paths and options (see DEFAULT_CONFIG), or a JSON file holding them.
+    targets : list[str] or None
+        Stage names to bring up to date, together with the stages they
+        depend on. None runs every stage.
+    force : bool
+        Run every selected stage even if its outputs are newer than its
+        inputs.
+    workers : int or None
+        If greater than 1, stages whose dependencies are done run at the
+        same time in up to that many processes (e.g. the precipitation
+        branch next to scrape_farm_data). None runs stages one at a time
+        in this process.
+    dry_run : bool
+        Only report which stages would run.
+    stages : list[dict] or None
+        Custom stage list; None uses `pipeline_stages(config)`.
+
+    Returns
+    -------
+    dict
+        "ran" and "skipped" stage names in completion order, and
+        "seconds" per stage that ran.
+    """
+    stages = pipeline_stages(config) if stages is None else stages
+    deps = stage_graph(stages)
+    by_name = {s["name"]: s for s in stages}
+
+    selected = set(by_name) if targets is None else set()
+    pending = list(targets or [])
+    while pending:
+        name = pending.pop()
+        if name not in by_name:
+            raise ValueError(f"unknown stage {name!r}; stages are {list(by_name)}")
+        if name not in selected:
+            selected.add(name)
+            pending.extend(deps[name])
+
+    produced = {out for s in stages for out in s["outputs"]}
+    missing = [p for name in selected for p in by_name[name]["inputs"]
+               if p not in produced and not os.path.exists(p)]
+    if missing:
+        raise FileNotFoundError(f"pipeline source files not found: {missing}")
+
+    result = {"ran": [], "skipped": [], "seconds": {}}
+    waiting = [s["name"] for s in stages if s["name"] in selected]
+    done, running = set(), {}
+    pool = ProcessPoolExecutor(max_workers=workers) if workers is not None and workers > 1 else None
+    try:
+        while waiting or running:
+            # Start (or skip) everything whose dependencies are done
+            for name in [n for n in waiting if all(d in done or d not in selected for d in deps[n])]:
+                waiting.remove(name)
+                stage = by_name[name]
+                # In a dry run nothing is rebuilt, so a stage after one that would run would run too
+                rebuilt = dry_run and any(d in result["ran"] for d in deps[name])
+                if not force and not rebuilt and _up_to_date(stage):
+                    print(f"[{name}] up to date, skipped")
+                    result["skipped"].append(name)
+                    done.add(name)
+                elif dry_run:
+                    print(f"[{name}] would run")
+                    result["ran"].append(name)
+                    done.add(name)
+                elif pool is None:
+                    print(f"[{name}] running")
+                    result["seconds"][name] = _timed_call(stage["func"], stage["kwargs"])
+                    print(f"[{name}] done in {result['seconds'][name]:.2f}s")
+                    result["ran"].append(name)
+                    done.add(name)
+                else:
+                    print(f"[{name}] running")
+                    running[pool.submit(_timed_call, stage["func"], stage["kwargs"])] = name
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                # A failed stage raises here; stages already running are let finish
+                result["seconds"][name] = future.result()
+                print(f"[{name}] done in {result['seconds'][name]:.2f}s")
+                result["ran"].append(name)
+                done.add(name)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+    return result
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="farm_precip_project",
+        description="Run the farm income / precipitation pipeline, skipping up-to-date stages.")
+    parser.add_argument("targets", nargs="*", help="stages to bring up to date (default: all)")
+    parser.add_argument("--config", help="JSON file with paths and options (see DEFAULT_CONFIG)")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override one config value, e.g. --set va_path=VA_State_US.xlsx")
+    parser.add_argument("--workers", type=int, help="run independent stages in this many processes")
+    parser.add_argument("--force", action="store_true", help="run stages even if up to date")
+    parser.add_argument("--dry-run", action="store_true", help="only show what would run")
+    parser.add_argument("--offline", action="store_true", help="skip the download and use the local .txt")
+    parser.add_argument("--list", action="store_true", help="list the stages and exit")
+    parser.add_argument("--trace", metavar="PATH", help="append per-call instrumentation records to this JSONL file")
+    parser.add_argument("--profile", nargs="+", metavar="FUNC",
+                        help="with --trace, run these functions (e.g. merge_csvs) under cProfile")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    for item in args.set:
+        key, _, value = item.partition("=")
+        # JSON for true/false/null, plain string otherwise
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        config = load_config({**config, key: value})
+    if args.offline:
+        config["url"] = None
+
+    if args.list:
+        stages = pipeline_stages(config)
+        for name, d in stage_graph(stages).items():
+            print(f"{name}: after {', '.join(d) or '-'}")
+        return 0
+    if args.trace:
+        from .instrument import enable_instrumentation, instrumentation_summary
+        enable_instrumentation(args.trace, profile=args.profile)
+    run_pipeline(config, args.targets or None, args.force, args.workers, args.dry_run)
+    if args.trace:
+        # Calls made in worker processes are only in the trace file
+        print(instrumentation_summary().to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from .cache import run_cached
+from .storage import read_table, write_table
+
+
+def _betainc(a, b, x, iterations=200):
+    """
+    Regularized incomplete beta I_x(a, b), elementwise, by the continued
+    fraction in Numerical Recipes (modified Lentz). Used for Student t
+    p-values so scipy is not needed.
+    """
+    a, b, x = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (a, b, x)))
+    # The fraction converges fast for x < (a + 1) / (a + b + 2); use the
+    # symmetry I_x(a, b) = 1 - I_{1-x}(b, a) otherwise
+    flip = x > (a + 1) / (a + b + 2)
+    a, b, x = np.where(flip, b, a), np.where(flip, a, b), np.where(flip, 1 - x, x)
+
+    tiny = 1e-300
+    c = np.ones_like(x)
+    d = 1 - (a + b) * x / (a + 1)
+    d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+    f = d.copy()
+    for m in range(1, iterations + 1):
+        for num in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                    -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1 + num * d
+            d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+            c = 1 + num / c
+            c = np.where(np.abs(c) < tiny, tiny, c)
+            f *= c * d
+        if np.all(np.abs(c * d - 1) < 1e-15):
+            break
+
+    lgamma = np.vectorize(math.lgamma, otypes=[np.float64])
+    with np.errstate(divide="ignore"):
+        log_front = (lgamma(a + b) - lgamma(a) - lgamma(b)
+                     + a * np.log(x) + b * np.log1p(-x))
+    result = np.exp(log_front) * f / a
+    return np.where(flip, 1 - result, result)
+
+
+def t_pvalue(t, dof):
+    """Two-sided p-value of a Student t statistic with `dof` degrees of freedom."""
+    t, dof = np.broadcast_arrays(np.asarray(t, dtype=np.float64), np.asarray(dof, dtype=np.float64))
+    p = np.full(t.shape, np.nan)
+    ok = (dof > 0) & ~np.isnan(t)
+    p[ok] = _betainc(dof[ok] / 2, 0.5, dof[ok] / (dof[ok] + t[ok] ** 2))
+    return p
+
+
+def state_ols(df, x="yearly_avg", y_cols=None, group="state"):
+    """
+    Fits y = intercept + slope * x separately for every (state, crop column)
+    in one vectorized pass.
+
+    Rows are sorted by state once and every sum is a NumPy group reduction
+    (np.add.reduceat) over an (n_rows, n_crops) block, so there is no
+    Python loop over states or columns. Each pair uses the rows where both
+    x and that crop are present (e.g. Cotton only where cotton is grown).
+    Sums are taken around each group's mean, which keeps Σ(y - ȳ)² exact
+    enough for incomes in the tens of millions.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Merged table, e.g. combined_farm_precip.csv.
+    x : str
+        Explanatory column.
+    y_cols : list[str] or None
+        Response columns. None uses every crop label (CROP_LABELS) in `df`.
+    group : str
+        Column to fit separately for.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per (group, crop) with n, slope, intercept, r, the two-sided
+        p-value of r (Student t with n - 2 dof) and the slope's standard
+        error. Groups with fewer than 3 usable rows get NaN.
+    """
+    if y_cols is None:
+        from .scrape_farm import CROP_LABELS
+        y_cols = [c for c in CROP_LABELS if c in df.columns]
+    y_cols = list(y_cols)
+
+    df = df.sort_values(group, kind="stable")
+    groups, starts = np.unique(df[group].to_numpy(), return_index=True)
+    X = df[x].to_numpy(dtype=np.float64, na_value=np.nan)[:, None]
+    Y = df[y_cols].to_numpy(dtype=np.float64, na_value=np.nan)
+    valid = ~np.isnan(X) & ~np.isnan(Y)
+    Xv = np.where(valid, X, 0.0)
+    Yv = np.where(valid, Y, 0.0)
+
+    def group_sum(a):
+        return np.add.reduceat(a, starts, axis=0)
+
+    n = group_sum(valid.astype(np.float64))
+    sizes = np.diff(np.append(starts, len(df)))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = group_sum(Xv) / n
+        y_mean = group_sum(Yv) / n
+        dx = np.where(valid, Xv - np.repeat(x_mean, sizes, axis=0), 0.0)
+        dy = np.where(valid, Yv - np.repeat(y_mean, sizes, axis=0), 0.0)
+        sxx = group_sum(dx * dx)
+        syy = group_sum(dy * dy)
+        sxy = group_sum(dx * dy)
+
+        slope = sxy / sxx
+        intercept = y_mean - slope * x_mean
+        r = np.clip(sxy / np.sqrt(sxx * syy), -1.0, 1.0)
+        dof = n - 2
+        t = r * np.sqrt(dof / (1 - r * r))
+        slope_se = np.sqrt((syy - slope * sxy) / dof / sxx)
+    t = np.where(np.abs(r) == 1, np.copysign(np.inf, r), t)
+    p = t_pvalue(t, dof)
+
+    small = n < 3
+    for a in (slope, intercept, r, p, slope_se):
+        a[small] = np.nan
+
+    return pd.DataFrame({
+        group: np.repeat(groups, len(y_cols)),
+        "crop": np.tile(y_cols, len(groups)),
+        "n": n.ravel().astype(np.int64),
+        "slope": slope.ravel(),
+        "intercept": intercept.ravel(),
+        "r": r.ravel(),
+        "p": p.ravel(),
+        "slope_se": slope_se.ravel(),
+    })
+
+
+def state_regressions(df_to_read, out_name, x="yearly_avg", y_cols=None, group="state", cache=False,
+                      storage=None):
+    """
+    Runs `state_ols` on a table file and writes the tidy results to
+    `out_name` (any `write_table` format). With `cache=True` the results
+    are reused until the input file or the arguments change.
+
+    Returns
+    -------
+    pd.DataFrame
+        The results table.
+    """
+    if cache:
+        result = {}
+        hit = run_cached("state_regressions",
+                         lambda: result.setdefault("df", state_regressions(df_to_read, out_name, x, y_cols,
+                                                                           group, storage=storage)),
+                         [df_to_read], [out_name],
+                         {"x": x, "y_cols": y_cols, "group": group, "storage": storage})
+        return read_table(out_name, storage=storage) if hit else result["df"]
+    results = state_ols(read_table(df_to_read), x, y_cols, group)
+    write_table(results, out_name, storage)
+    return results
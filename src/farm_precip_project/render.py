@@ -0,0 +1,287 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .cache import CACHE_DIR, file_hash
+
+# Batch figure rendering for the site. Every figure is described by a spec
+# (a JSON-able dict) and drawn on its own matplotlib Figure attached to an
+# Agg canvas, so nothing touches pyplot's global state and specs can be
+# rendered in parallel processes:
+#
+#   {"kind": "group_trend", "data": "combined_farm_precip.csv",
+#    "out": "plots/precip_over_time.png", "params": {...},
+#    "subset": {"state": 1}, "center": ["yearly_avg", "state", "income_centered"],
+#    "figsize": [12, 6], "dpi": 300, "bbox_inches": "tight"}
+#
+# Only kind, data and out are required.
+#
+# A spec is skipped when its output exists and the hash of the spec plus
+# the data file matches the last render (stored in RENDER_MANIFEST).
+RENDER_VERSION = 1
+RENDER_MANIFEST = os.path.join(CACHE_DIR, "render_manifest.json")
+
+# Scatter drawers switch from one marker per row to binned density above
+# this many rows (mode="auto"). "raster" keeps markers but rasterizes them,
+# which keeps vector outputs (PDF/SVG) small.
+SCATTER_MODES = ("points", "raster", "hexbin")
+SCATTER_POINT_LIMIT = 20_000
+HEXBIN_GRIDSIZE = 80
+
+
+# ---------------------------------------------------------
+# Drawers: draw(fig, df, **params) on an existing Figure
+# ---------------------------------------------------------
+def draw_group_trend(fig, df, column, group_by="year", titles=("", "", "")):
+    ax = fig.add_subplot()
+    ax.plot(df.groupby(group_by)[column].mean())
+    ax.set_xlabel(titles[0])
+    ax.set_ylabel(titles[1])
+    ax.set_title(titles[2])
+    fig.tight_layout()
+
+
+def _scatter_mode(n, mode, max_points):
+    if mode == "auto":
+        return "points" if n <= max_points else "hexbin"
+    if mode not in SCATTER_MODES:
+        raise ValueError(f"mode must be 'auto' or one of {SCATTER_MODES}, not {mode!r}")
+    return mode
+
+
+def _draw_points(fig, ax, x, y, mode, s=None, colorbar="right", **kwargs):
+    """Markers, a rasterized collection, or log-scaled hexagonal bins."""
+    if mode == "hexbin":
+        bins = ax.hexbin(x, y, gridsize=HEXBIN_GRIDSIZE, bins="log", mincnt=1, cmap="viridis", linewidths=0)
+        fig.colorbar(bins, ax=ax, label="Count", location=colorbar)
+    else:
+        ax.scatter(x, y, s=s, rasterized=(mode == "raster"), **kwargs)
+
+
+def draw_scatter(fig, df, colx, coly, titles=None, s=None, n_digits=None, mode="auto",
+                 max_points=SCATTER_POINT_LIMIT):
+    ax = fig.add_subplot()
+    _draw_points(fig, ax, df[colx], df[coly], _scatter_mode(len(df), mode, max_points), s=s)
+    if titles is None:
+        title = f"Scatter plot of {colx} vs {coly}"
+        if n_digits is not None:
+            title += f", Correlation: {round(df[colx].corr(df[coly]), n_digits)}"
+        titles = (colx, coly, title)
+    ax.set_xlabel(titles[0])
+    ax.set_ylabel(titles[1])
+    ax.set_title(titles[2])
+    fig.tight_layout()
+
+
+def draw_group_means_scatter(fig, df, group, colx, coly, titles):
+    means = df.groupby(group)[[colx, coly]].mean()
+    draw_scatter(fig, means, colx, coly, titles)
+
+
+def draw_heatmap(fig, df=None, title="Correlation Heatmap", corr=None, rows=None, cols=("yearly_avg",),
+                 center_by=None):
+    from .correlation import correlation_matrix, _crop_columns
+
+    if corr is None:
+        corr = correlation_matrix(df, _crop_columns(df) if rows is None else rows, cols, center_by)
+    n_rows, n_cols = corr.shape
+    # Grow with the matrix so every crop and feature label fits
+    fig.set_size_inches(max(6, 2 + 0.35 * n_cols), max(5, 1.5 + 0.4 * n_rows))
+    ax = fig.add_subplot()
+    image = ax.imshow(corr, cmap="coolwarm", vmin=-1, vmax=1, aspect="auto")
+    fig.colorbar(image, ax=ax, label="Correlation")
+    ax.set_xticks(range(n_cols), corr.columns, rotation=90 if n_cols > 4 else 0)
+    ax.set_yticks(range(n_rows), corr.index)
+    ax.set_title(title)
+    fig.tight_layout()
+
+
+def draw_scatter_by_category(fig, df, colx, coly, colcat, mode="auto", max_points=SCATTER_POINT_LIMIT,
+                             fit_lines=None):
+    """
+    Scatter coloured by `colcat`. Above `max_points` rows (mode="auto") the
+    points become one hexbin density and each category is shown as its own
+    least-squares line (`state_ols`) over its x range instead. fit_lines
+    forces the lines on or off; by default they are drawn only without
+    per-point colours.
+    """
+    import seaborn as sns
+
+    ax = fig.add_subplot()
+    cat_order = sorted(df[colcat].unique())
+    palette = sns.color_palette("husl", len(cat_order))
+    mode = _scatter_mode(len(df), mode, max_points)
+    if mode == "points":
+        sns.scatterplot(data=df, x=colx, y=coly, hue=colcat, hue_order=cat_order,
+                        palette=palette, s=30, ax=ax)
+    else:
+        # Colorbar below, since the category legend sits on the right
+        _draw_points(fig, ax, df[colx], df[coly], mode, s=4, colorbar="bottom", c="0.6")
+    if fit_lines is None:
+        fit_lines = mode != "points"
+
+    if fit_lines:
+        from .regression import state_ols
+
+        fits = state_ols(df, x=colx, y_cols=[coly], group=colcat).set_index(colcat)
+        span = df.dropna(subset=[colx, coly]).groupby(colcat)[colx].agg(["min", "max"])
+        for cat, color in zip(cat_order, palette):
+            if cat not in span.index or np.isnan(fits.at[cat, "slope"]):
+                continue
+            xs = span.loc[cat].to_numpy()
+            ax.plot(xs, fits.at[cat, "intercept"] + fits.at[cat, "slope"] * xs, color=color, lw=1.2,
+                    label=None if mode == "points" else cat)
+        ax.set_xlabel(colx)
+        ax.set_ylabel(coly)
+
+    if ax.get_legend_handles_labels()[0]:
+        leg = ax.legend(title=colcat, bbox_to_anchor=(1.02, 1), loc="upper left", borderaxespad=0., ncol=2)
+        for text in leg.get_texts():
+            text.set_fontsize(8)  # smaller labels
+
+
+# kind -> (drawer, default figsize)
+DRAWERS = {
+    "group_trend": (draw_group_trend, (12, 6)),
+    "scatter": (draw_scatter, (8, 6)),
+    "group_means_scatter": (draw_group_means_scatter, (12, 6)),
+    "heatmap": (draw_heatmap, (6, 5)),
+    "scatter_by_category": (draw_scatter_by_category, (6.4, 4.8)),
+}
+
+# The figures written to plots/ by eda_work and analysis
+SITE_FIGURES = [
+    {"kind": "group_trend", "out": "plots/precip_over_time.png",
+     "params": {"column": "yearly_avg", "group_by": "year",
+                "titles": ["Year", "Mean Normalized Precipitation",
+                           "Average Precipitation Across the U.S. Over Time"]}},
+    {"kind": "group_trend", "out": "plots/crop_income_over_time.png",
+     "params": {"column": "Crop cash receipts", "group_by": "year",
+                "titles": ["Year", "Mean Crop Cash Receipts", "Crop Income Trends Over Time"]}},
+    {"kind": "scatter", "out": "plots/precip_vs_income_scatter.png",
+     "params": {"colx": "yearly_avg", "coly": "Crop cash receipts", "s": 10,
+                "titles": ["Normalized Precipitation", "Crop Cash Receipts",
+                           "Relationship Between Precipitation and Crop Income"]},
+     "figsize": [12, 6]},
+    {"kind": "group_means_scatter", "out": "plots/state_level_precip_vs_income.png",
+     "params": {"group": "state", "colx": "yearly_avg", "coly": "Crop cash receipts",
+                "titles": ["Mean Normalized Precipitation", "Mean Crop Cash Receipts",
+                           "State-Level Comparison: Income vs Precipitation"]}},
+    {"kind": "heatmap", "out": "plots/correlation_heatmap.png", "params": {}},
+    {"kind": "scatter", "out": "plots/plot_yearly_avg_vs_Value of crop production.png",
+     "params": {"colx": "yearly_avg", "coly": "Value of crop production", "n_digits": 4}},
+    {"kind": "scatter_by_category", "out": "plots/plot_yearly_avg_vs_income_centered_by_state.png",
+     "center": ["yearly_avg", "state", "income_centered"], "bbox_inches": "tight",
+     "params": {"colx": "yearly_avg", "coly": "income_centered", "colcat": "state"}},
+]
+
+
+def site_figures(data="combined_farm_precip.csv", dpi=300):
+    """The SITE_FIGURES specs, reading `data`."""
+    return [{**spec, "data": data, "dpi": dpi} for spec in SITE_FIGURES]
+
+
+def state_crop_figures(states, crops, data="combined_farm_precip.csv", out_dir="plots/states", dpi=150):
+    """One precipitation vs income scatter spec per (state, crop)."""
+    return [
+        {"kind": "scatter", "data": data, "dpi": dpi, "subset": {"state": int(state)},
+         "out": os.path.join(out_dir, f"state_{int(state)}_{crop.replace(' ', '_')}.png"),
+         "params": {"colx": "yearly_avg", "coly": crop, "n_digits": 4}}
+        for state in states for crop in crops
+    ]
+
+
+# ---------------------------------------------------------
+# Rendering
+# ---------------------------------------------------------
+def spec_hash(spec, data_hash=None):
+    """Hash of the spec, the drawing code version and the data file contents."""
+    h = hashlib.sha256()
+    h.update(json.dumps({"spec": spec, "version": RENDER_VERSION}, sort_keys=True, default=str).encode())
+    h.update((data_hash or file_hash(spec["data"])).encode())
+    return h.hexdigest()
+
+
+_frames = {}
+
+
+def _load(path):
+    # One read per data file per worker process
+    from .storage import read_table
+
+    key = (path, os.path.getmtime(path))
+    if key not in _frames:
+        _frames[key] = read_table(path)
+    return _frames[key]
+
+
+def render_spec(spec):
+    """Draws one spec on an Agg canvas and writes it to spec["out"]."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    drawer, figsize = DRAWERS[spec["kind"]]
+    df = _load(spec["data"])
+    for col, value in spec.get("subset", {}).items():
+        df = df[df[col] == value]
+    if spec.get("center"):
+        from .analysis import center_column
+        df = center_column(df.copy(), *spec["center"])
+
+    fig = Figure(figsize=spec.get("figsize", figsize))
+    FigureCanvasAgg(fig)
+    drawer(fig, df, **spec.get("params", {}))
+    os.makedirs(os.path.dirname(spec["out"]) or ".", exist_ok=True)
+    # bbox_inches="tight" keeps legends placed outside the axes
+    fig.savefig(spec["out"], dpi=spec.get("dpi", 300), bbox_inches=spec.get("bbox_inches"))
+    return spec["out"]
+
+
+def render_figures(specs, workers=None, force=False, manifest=RENDER_MANIFEST):
+    """
+    Renders a list of figure specs, skipping the ones that are up to date.
+
+    Parameters
+    ----------
+    specs : list[dict]
+        Figure specs (see `site_figures` and `state_crop_figures`).
+    workers : int or None
+        If greater than 1, specs are rendered in that many processes.
+    force : bool
+        Render every spec even if its hash is unchanged.
+    manifest : str
+        JSON file remembering the hash each output was rendered from.
+
+    Returns
+    -------
+    dict
+        Lists of "rendered" and "skipped" output paths.
+    """
+    try:
+        with open(manifest) as f:
+            done = json.load(f)
+    except (OSError, ValueError):
+        done = {}
+
+    data_hashes = {path: file_hash(path) for path in {spec["data"] for spec in specs}}
+    hashes = {spec["out"]: spec_hash(spec, data_hashes[spec["data"]]) for spec in specs}
+    todo = [spec for spec in specs
+            if force or done.get(spec["out"]) != hashes[spec["out"]] or not os.path.exists(spec["out"])]
+    todo_outs = {spec["out"] for spec in todo}
+    skipped = [spec["out"] for spec in specs if spec["out"] not in todo_outs]
+
+    if workers is None or workers <= 1 or len(todo) <= 1:
+        rendered = [render_spec(spec) for spec in todo]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+            rendered = list(pool.map(render_spec, todo, chunksize=max(1, len(todo) // (4 * workers))))
+
+    done.update({out: hashes[out] for out in rendered})
+    os.makedirs(os.path.dirname(manifest) or ".", exist_ok=True)
+    with open(manifest, "w") as f:
+        json.dump(done, f, indent=1, sort_keys=True)
+    print(f"Rendered {len(rendered)} figure(s), skipped {len(skipped)} unchanged.")
+    return {"rendered": rendered, "skipped": skipped}
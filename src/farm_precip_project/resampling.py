@@ -0,0 +1,165 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Resampled correlations for the state-centered analysis. Resamples are
+# drawn in batches as 2-D index arrays (one row per resample) and every
+# correlation in a batch is computed at once. The pooled and per-state
+# correlations share the same draws.
+#
+# Both methods resample within each state, which keeps the panel layout
+# (every state keeps its number of years) and is what makes the pooled
+# correlation of state-centered income meaningful:
+#   bootstrap   - years drawn with replacement inside each state
+#   permutation - y shuffled across the years of each state
+
+# Resamples per independently seeded chunk (the unit handed to a worker)
+RESAMPLE_CHUNK = 2000
+
+
+def _prepare(df, x, y, group):
+    """
+    Drops rows missing x or y and sorts by group. Returns the centered
+    arrays and the group layout.
+    """
+    df = df[[group, x, y]].dropna().sort_values(group, kind="stable")
+    groups, starts = np.unique(df[group].to_numpy(), return_index=True)
+    sizes = np.diff(np.append(starts, len(df)))
+    # A constant shift does not change r; centering on the full-sample mean
+    # keeps the one-pass sums in _batch_corr precise for income in the 1e9s
+    x_arr = df[x].to_numpy(dtype=np.float64)
+    y_arr = df[y].to_numpy(dtype=np.float64)
+    return x_arr - x_arr.mean(), y_arr - y_arr.mean(), groups, starts, sizes
+
+
+def _batch_corr(xs, ys, starts):
+    """
+    Pearson r of every row of the (batch, n) arrays `xs` and `ys`, pooled
+    and per group. Returns a (batch, 1 + n_groups) array, pooled first.
+    """
+    def sums(a):
+        per_group = np.add.reduceat(a, starts, axis=1)
+        return np.column_stack([per_group.sum(axis=1), per_group])
+
+    sizes = np.diff(np.append(starts, xs.shape[1]))
+    n = np.concatenate([[sizes.sum()], sizes]).astype(np.float64)
+    sx, sy = sums(xs), sums(ys)
+    sxx = sums(xs * xs) - sx * sx / n
+    syy = sums(ys * ys) - sy * sy / n
+    sxy = sums(xs * ys) - sx * sy / n
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sxy / np.sqrt(sxx * syy)
+
+
+def _resample_indices(rng, count, starts, sizes, kind):
+    """(count, n) row indices for `count` within-group resamples."""
+    n = int(sizes.sum())
+    offsets = np.repeat(starts, sizes)
+    if kind == "bootstrap":
+        return offsets + (rng.random((count, n)) * np.repeat(sizes, sizes)).astype(np.int64)
+    # Sorting random keys offset by the group position permutes within groups
+    keys = rng.random((count, n)) + np.repeat(np.arange(len(sizes)), sizes)
+    return np.argsort(keys, axis=1, kind="stable")
+
+
+def _resample_chunk(kind, x, y, starts, sizes, seed, count, batch):
+    """Runs `count` resamples in batches; returns a (count, 1 + n_groups) array of r."""
+    rng = np.random.default_rng(seed)
+    out = []
+    for done in range(0, count, batch):
+        idx = _resample_indices(rng, min(batch, count - done), starts, sizes, kind)
+        if kind == "bootstrap":
+            out.append(_batch_corr(x[idx], y[idx], starts))
+        else:
+            out.append(_batch_corr(np.broadcast_to(x, idx.shape), y[idx], starts))
+    return np.concatenate(out)
+
+
+def _resample(kind, df, x, y, group, n_resamples, seed, workers, batch):
+    x_arr, y_arr, groups, starts, sizes = _prepare(df, x, y, group)
+    observed = _batch_corr(x_arr[None, :], y_arr[None, :], starts)[0]
+
+    # Fixed-size chunks with their own child seeds: the draws depend only on
+    # `seed`, not on `workers` or `batch`
+    counts = [min(RESAMPLE_CHUNK, n_resamples - i) for i in range(0, n_resamples, RESAMPLE_CHUNK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    args = [(kind, x_arr, y_arr, starts, sizes, s, c, batch) for s, c in zip(seeds, counts)]
+    if workers is None or workers <= 1 or len(args) == 1:
+        results = [_resample_chunk(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(args))) as pool:
+            results = list(pool.map(_resample_chunk, *zip(*args)))
+
+    labels = ["pooled"] + groups.tolist()
+    n = np.concatenate([[sizes.sum()], sizes])
+    return observed, np.concatenate(results), labels, n
+
+
+def bootstrap_corr(df, x="yearly_avg", y="income_centered", group="state", n_resamples=2000, ci=0.95,
+                   seed=None, workers=None, batch=500):
+    """
+    Bootstrap confidence intervals for the pooled and per-state
+    correlations of `x` and `y`.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Merged table, usually after `center_column` (y is then the
+        state-centered income).
+    x, y, group : str
+        Columns to correlate and the column to resample within.
+    n_resamples : int
+        Number of bootstrap resamples.
+    ci : float
+        Confidence level of the percentile interval.
+    seed : int or None
+        Fixes the draws; the same seed gives the same result for any
+        `workers` and `batch`. None draws fresh randomness.
+    workers : int or None
+        If greater than 1, chunks of RESAMPLE_CHUNK resamples run in that
+        many processes.
+    batch : int
+        Resamples per vectorized batch (memory is about
+        batch x rows x 8 bytes per array).
+
+    Returns
+    -------
+    pd.DataFrame
+        One row for "pooled" and one per state: n, r, ci_low, ci_high and
+        the bootstrap standard error of r.
+    """
+    observed, draws, labels, n = _resample("bootstrap", df, x, y, group, n_resamples, seed, workers, batch)
+    alpha = (1 - ci) / 2
+    with np.errstate(invalid="ignore"):
+        low, high = np.nanquantile(draws, [alpha, 1 - alpha], axis=0)
+    return pd.DataFrame({
+        group: labels,
+        "n": n,
+        "r": observed,
+        "ci_low": low,
+        "ci_high": high,
+        "se": np.nanstd(draws, axis=0, ddof=1),
+    })
+
+
+def permutation_corr(df, x="yearly_avg", y="income_centered", group="state", n_resamples=2000, seed=None,
+                     workers=None, batch=500):
+    """
+    Two-sided permutation p-values for the pooled and per-state
+    correlations of `x` and `y`, shuffling `y` within each state.
+
+    Parameters are as in `bootstrap_corr`.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row for "pooled" and one per state: n, r and
+        p = (1 + #{|r*| >= |r|}) / (1 + n_resamples).
+    """
+    observed, draws, labels, n = _resample("permutation", df, x, y, group, n_resamples, seed, workers, batch)
+    # Tolerance so ties with the observed value (e.g. the identity shuffle) count
+    extreme = np.abs(draws) >= np.abs(observed) * (1 - 1e-12)
+    p = (1 + extreme.sum(axis=0)) / (1 + len(draws))
+    p[np.isnan(observed)] = np.nan
+    return pd.DataFrame({group: labels, "n": n, "r": observed, "p": p})
@@ -1,11 +1,115 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
+import openpyxl
+
+from .cache import run_cached
+from .instrument import instrument
+from .storage import write_table
 
 def farm_test():
     """Placeholder for future unit tests."""
     pass
 
 
+# ---------------------------------------------------------
+# Crop-block labels (first column of each state sheet) in FarmIncome order
+# ---------------------------------------------------------
+CROP_LABELS = [
+    "Value of crop production",
+    "Crop cash receipts",
+    "Cotton",
+    "Feed crops",
+    "Food grains",
+    "Fruits and nuts",
+    "Oil crops",
+    "Vegetables and melons",
+    "All other crops",
+    "Home consumption",
+    # There are multiple "Inventory adjustment" rows;
+    # first one (right after the crop block) = crop inventory adjustment
+    "Inventory adjustment",
+]
+
+# ---------------------------------------------------------
+# State numbering: 1–48 in alphabetical order
+# ---------------------------------------------------------
+CONTIGUOUS_STATES = [
+    "Alabama",        # 1
+    "Arizona",        # 2
+    "Arkansas",       # 3
+    "California",     # 4
+    "Colorado",       # 5
+    "Connecticut",    # 6
+    "Delaware",       # 7
+    "Florida",        # 8
+    "Georgia",        # 9
+    "Idaho",          # 10
+    "Illinois",       # 11
+    "Indiana",        # 12
+    "Iowa",           # 13
+    "Kansas",         # 14
+    "Kentucky",       # 15
+    "Louisiana",      # 16
+    "Maine",          # 17
+    "Maryland",       # 18
+    "Massachusetts",  # 19
+    "Michigan",       # 20
+    "Minnesota",      # 21
+    "Mississippi",    # 22
+    "Missouri",       # 23
+    "Montana",        # 24
+    "Nebraska",       # 25
+    "Nevada",         # 26
+    "New Hampshire",  # 27
+    "New Jersey",     # 28
+    "New Mexico",     # 29
+    "New York",       # 30
+    "North Carolina", # 31
+    "North Dakota",   # 32
+    "Ohio",           # 33
+    "Oklahoma",       # 34
+    "Oregon",         # 35
+    "Pennsylvania",   # 36
+    "Rhode Island",   # 37
+    "South Carolina", # 38
+    "South Dakota",   # 39
+    "Tennessee",      # 40
+    "Texas",          # 41
+    "Utah",           # 42
+    "Vermont",        # 43
+    "Virginia",       # 44
+    "Washington",     # 45
+    "West Virginia",  # 46
+    "Wisconsin",      # 47
+    "Wyoming",        # 48
+]
+
+# Strings pandas.read_excel turns into NaN by default ("NA" fills the
+# early-year cells of the VA workbook).
+_EXCEL_NA_STRINGS = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None",
+    "n/a", "nan", "null",
+}
+
+
+def _excel_value(v):
+    """Convert a raw openpyxl cell value the same way pandas.read_excel does."""
+    if v is None:
+        return np.nan
+    if isinstance(v, str):
+        return np.nan if v in _EXCEL_NA_STRINGS else v
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return v
+
+
+_to_excel_values = np.frompyfunc(_excel_value, 1, 1)
+
+
 # ---------------------------------------------------------
 # Utility: return the first row in a DataFrame that matches a label in col 0
 # ---------------------------------------------------------
@@ -26,6 +130,7 @@ def row_by_label(df: pd.DataFrame, label: str):
 # ---------------------------------------------------------
 # Helper: extract crop block for one state from VA workbook
 # ---------------------------------------------------------
+@instrument
 def extract_state_rows(va_path, sheet_name, state_id, years_needed):
     """
     Pulls crop-related data for one state from the VA workbook and
@@ -48,136 +153,205 @@ def extract_state_rows(va_path, sheet_name, state_id, years_needed):
         Records with columns matching FarmIncome.
     """
     df = pd.read_excel(va_path, sheet_name=sheet_name)
+    if df.shape[1] == 0:
+        return pd.DataFrame()
 
     # Row 1 (index 1) has the year labels as strings: '1924', '1925', ...
-    year_row = df.iloc[1]
-    # Map year (int) -> column name (e.g., 'Unnamed: 27')
-    year_to_col = {
-        int(v): col_name
-        for col_name, v in year_row.items()
+    year_row = df.iloc[1].to_numpy()
+    # Map year (int) -> column position
+    year_to_pos = {
+        int(v): pos
+        for pos, v in enumerate(year_row)
         if isinstance(v, str) and v.isdigit()
     }
 
-    # Crop-block rows we want to match FarmIncome
-    row_value  = row_by_label(df, "Value of crop production")
-    row_cash   = row_by_label(df, "Crop cash receipts")
-    row_cotton = row_by_label(df, "Cotton")
-    row_feed   = row_by_label(df, "Feed crops")
-    row_food   = row_by_label(df, "Food grains")
-    row_fruit  = row_by_label(df, "Fruits and nuts")
-    row_oil    = row_by_label(df, "Oil crops")
-    row_veg    = row_by_label(df, "Vegetables and melons")
-    row_other  = row_by_label(df, "All other crops")
-    row_home   = row_by_label(df, "Home consumption")
-
-    # There are multiple "Inventory adjustment" rows;
-    # first one (right after the crop block) = crop inventory adjustment
+    # One pass over column 0: row position of the first occurrence of each
+    # label (the first "Inventory adjustment" is the crop one), -1 if absent
     labels = df.iloc[:, 0]
-    inv_indices = labels[labels == "Inventory adjustment"].index
-    row_inv = df.loc[inv_indices[0]] if len(inv_indices) > 0 else None
-
-    records = []
-    for y in years_needed:
-        col_name = year_to_col.get(int(y))
-        if col_name is None:
-            # If the sheet doesn't have that year, skip
-            continue
-
-        rec = {
-            "state": state_id,
-            "year": int(y),
-            "Value of crop production":   row_value[col_name] if row_value is not None else np.nan,
-            "Crop cash receipts":         row_cash[col_name] if row_cash is not None else np.nan,
-            "Cotton":                     row_cotton[col_name] if row_cotton is not None else np.nan,
-            "Feed crops":                 row_feed[col_name] if row_feed is not None else np.nan,
-            "Food grains":                row_food[col_name] if row_food is not None else np.nan,
-            "Fruits and nuts":            row_fruit[col_name] if row_fruit is not None else np.nan,
-            "Oil crops":                  row_oil[col_name] if row_oil is not None else np.nan,
-            "Vegetables and melons":      row_veg[col_name] if row_veg is not None else np.nan,
-            "All other crops":            row_other[col_name] if row_other is not None else np.nan,
-            "Home consumption":           row_home[col_name] if row_home is not None else np.nan,
-            "Inventory adjustment":       row_inv[col_name] if row_inv is not None else np.nan,
-        }
-        records.append(rec)
-
-    return pd.DataFrame.from_records(records)
-
-
-def scrape_farm_data():
-    # ---------------------------------------------------------
-    # 1. File paths (same folder as your current Excel files)
-    # ---------------------------------------------------------
-    farm_path = "FarmIncome.xlsx"
-    va_path   = "VA_State_US (1).xlsx"
+    first = ~labels.duplicated().to_numpy()
+    label_index = pd.Index(labels.to_numpy()[first])
+    found = label_index.get_indexer(CROP_LABELS)
+    row_pos = np.where(found >= 0, np.flatnonzero(first)[found], -1)
+
+    years = [int(y) for y in years_needed if int(y) in year_to_pos]
+    col_pos = [year_to_pos[y] for y in years]
+
+    # Whole crop block x year columns in one slice; missing rows stay NaN
+    values = df.to_numpy(dtype=object)[np.ix_(np.maximum(row_pos, 0), col_pos)]
+    values[row_pos < 0] = np.nan
+
+    return _crop_block_frame(values, state_id, years)
+
+
+def _crop_block_frame(values, state_id, years, labels=CROP_LABELS):
+    """
+    Transposes a (labels x years) object array of crop values into the
+    per-year FarmIncome layout: state, year, then one column per label.
+    """
+    if len(years) == 0:
+        return pd.DataFrame()
+    out = pd.DataFrame(values.T, columns=labels).infer_objects()
+    out.insert(0, "year", np.asarray(years, dtype=np.int64))
+    out.insert(0, "state", np.int64(state_id))
+    return out
+
+
+# ---------------------------------------------------------
+# Single-pass reader: open the VA workbook once, stream the state sheets
+# ---------------------------------------------------------
+@instrument
+def read_state_blocks(va_path, sheet_names, labels=CROP_LABELS):
+    """
+    Opens the VA workbook once in read-only mode and streams each requested
+    sheet row by row, keeping only the year header and the crop-block rows.
+
+    Parameters
+    ----------
+    va_path : str
+        Path to the VA_State_US workbook.
+    sheet_names : list[str]
+        Sheets to read (one per state).
+    labels : list[str]
+        Row labels (column 0) to keep. The first match of each label wins,
+        as in `row_by_label`.
+
+    Returns
+    -------
+    dict[str, tuple[dict[int, int], dict[str, tuple]]]
+        For each sheet: a map of year -> column position, and a map of
+        label -> raw row values.
+    """
+    wanted = set(labels)
+    blocks = {}
+    wb = openpyxl.load_workbook(va_path, read_only=True, data_only=True)
+    try:
+        for sheet_name in sheet_names:
+            year_to_pos = {}
+            rows = {}
+            for i, row in enumerate(wb[sheet_name].iter_rows(values_only=True)):
+                if i == 2:
+                    # Third sheet row holds the year labels: '1924', '1925', ...
+                    year_to_pos = {
+                        int(v): pos
+                        for pos, v in enumerate(row)
+                        if isinstance(v, str) and v.isdigit()
+                    }
+                    continue
+                if not row:
+                    continue
+                label = row[0]
+                if label in wanted and label not in rows:
+                    rows[label] = row
+                    if len(rows) == len(wanted):
+                        # Crop block sits at the top of the sheet; stop early
+                        break
+            blocks[sheet_name] = (year_to_pos, rows)
+    finally:
+        wb.close()
+    return blocks
+
 
+def block_to_frame(block, state_id, years_needed, labels=CROP_LABELS):
+    """
+    Turns one sheet block from `read_state_blocks` into the same DataFrame
+    `extract_state_rows` returns for that state.
+    """
+    year_to_pos, rows = block
+    years = [int(y) for y in years_needed if int(y) in year_to_pos]
+    col_pos = np.asarray([year_to_pos[y] for y in years], dtype=np.intp)
+
+    # Pad the streamed rows into one (labels x columns) grid, then take
+    # every year column in a single slice
+    grid = np.full((len(labels), int(col_pos.max(initial=-1)) + 1), None, dtype=object)
+    for i, label in enumerate(labels):
+        row = rows.get(label)
+        if row is not None:
+            row = row[:grid.shape[1]]
+            grid[i, :len(row)] = row
+    values = _to_excel_values(grid[:, col_pos])
+
+    return _crop_block_frame(values, state_id, years, labels)
+
+
+# Opening the VA workbook (shared strings, styles) takes about 4 s, while
+# streaming one state sheet out of an open workbook takes well under 0.1 s.
+# Every "stream" worker pays the opening cost again, so a worker only pays
+# for itself with many sheets. The "pandas" reader reopens the workbook for
+# each sheet anyway and has no such floor.
+_STREAM_SHEETS_PER_WORKER = 64
+
+
+def _extract_states(va_path, states, years, reader):
+    """
+    Extracts a list of (state_id, sheet_name) pairs and returns one frame per
+    state. Runs in the calling process or inside a pool worker.
+    """
+    if reader == "stream":
+        blocks = read_state_blocks(va_path, [name for _, name in states])
+        return [block_to_frame(blocks[name], state_id, years) for state_id, name in states]
+    if reader == "pandas":
+        return [extract_state_rows(va_path, name, state_id, years) for state_id, name in states]
+    raise ValueError(f"reader must be 'stream' or 'pandas', not {reader!r}")
+
+
+@instrument
+def build_farm_frame(farm_path, va_path, reader="stream", workers=None, states=None):
+    """
+    Builds the FarmIncome_full table (48 states by default) without writing it.
+
+    Parameters
+    ----------
+    farm_path : str
+        Path to FarmIncome.xlsx (source of the years and column order).
+    va_path : str
+        Path to the VA_State_US workbook.
+    reader : {"stream", "pandas"}
+        "stream" opens the workbook once with `read_state_blocks`;
+        "pandas" is the original path, one `extract_state_rows`
+        (a full `pd.read_excel`) per state.
+    workers : int or None
+        If greater than 1, the state sheets are split into up to that many
+        chunks and each chunk is parsed in its own process. None (the
+        default) parses every sheet serially in this process. With the
+        "stream" reader each worker reopens the workbook, so a chunk gets
+        at least 64 sheets and the 48 contiguous states always run
+        serially: on the checked-in workbooks 4 workers took 13.3 s
+        against 5.4 s serial. The pool helps the "pandas" reader, or
+        workbooks with several hundred sheets, given free cores.
+    states : list[str] or None
+        Sheet names to read, numbered 1, 2, ... in this order. None uses
+        CONTIGUOUS_STATES.
+
+    Returns
+    -------
+    pd.DataFrame
+        Rows sorted by state and year, columns in FarmIncome order.
+    """
     # Read FarmIncome ONLY to grab the years and the column order you like
     farm_df = pd.read_excel(farm_path, sheet_name="Sheet1")
     years = sorted(farm_df["year"].unique())
     cols  = list(farm_df.columns)
 
-    # ---------------------------------------------------------
-    # 2. State numbering: 1–48 in alphabetical order
-    # ---------------------------------------------------------
-    contiguous_states = [
-        "Alabama",        # 1
-        "Arizona",        # 2
-        "Arkansas",       # 3
-        "California",     # 4
-        "Colorado",       # 5
-        "Connecticut",    # 6
-        "Delaware",       # 7
-        "Florida",        # 8
-        "Georgia",        # 9
-        "Idaho",          # 10
-        "Illinois",       # 11
-        "Indiana",        # 12
-        "Iowa",           # 13
-        "Kansas",         # 14
-        "Kentucky",       # 15
-        "Louisiana",      # 16
-        "Maine",          # 17
-        "Maryland",       # 18
-        "Massachusetts",  # 19
-        "Michigan",       # 20
-        "Minnesota",      # 21
-        "Mississippi",    # 22
-        "Missouri",       # 23
-        "Montana",        # 24
-        "Nebraska",       # 25
-        "Nevada",         # 26
-        "New Hampshire",  # 27
-        "New Jersey",     # 28
-        "New Mexico",     # 29
-        "New York",       # 30
-        "North Carolina", # 31
-        "North Dakota",   # 32
-        "Ohio",           # 33
-        "Oklahoma",       # 34
-        "Oregon",         # 35
-        "Pennsylvania",   # 36
-        "Rhode Island",   # 37
-        "South Carolina", # 38
-        "South Dakota",   # 39
-        "Tennessee",      # 40
-        "Texas",          # 41
-        "Utah",           # 42
-        "Vermont",        # 43
-        "Virginia",       # 44
-        "Washington",     # 45
-        "West Virginia",  # 46
-        "Wisconsin",      # 47
-        "Wyoming",        # 48
-    ]
-
-    # ---------------------------------------------------------
-    # 3. Build ALL 48 states from VA_State_US (1).xlsx
-    # ---------------------------------------------------------
-    all_states = []
+    states = list(enumerate(CONTIGUOUS_STATES if states is None else states, start=1))
+    if reader not in ("stream", "pandas"):
+        raise ValueError(f"reader must be 'stream' or 'pandas', not {reader!r}")
 
-    for state_id, state_name in enumerate(contiguous_states, start=1):
-        #print(f"Processing state {state_id}: {state_name}")
-        df_state = extract_state_rows(va_path, state_name, state_id, years)
-        all_states.append(df_state)
+    n_chunks = min(workers or 1, len(states))
+    if reader == "stream":
+        n_chunks = min(n_chunks, len(states) // _STREAM_SHEETS_PER_WORKER)
+    if n_chunks <= 1:
+        all_states = _extract_states(va_path, states, years, reader)
+    else:
+        # Contiguous chunks so each worker streams neighbouring sheets
+        size = -(-len(states) // n_chunks)
+        chunks = [states[i:i + size] for i in range(0, len(states), size)]
+        with ProcessPoolExecutor(max_workers=n_chunks) as pool:
+            results = pool.map(
+                _extract_states,
+                [va_path] * len(chunks), chunks,
+                [years] * len(chunks), [reader] * len(chunks),
+            )
+            all_states = [frame for chunk_frames in results for frame in chunk_frames]
 
     all_states_df = pd.concat(all_states, ignore_index=True)
 
@@ -185,15 +359,66 @@ def scrape_farm_data():
     all_states_df = all_states_df[cols]
 
     # Sort by state, then year
-    all_states_df = all_states_df.sort_values(["state", "year"]).reset_index(drop=True)
+    return all_states_df.sort_values(["state", "year"]).reset_index(drop=True)
+
+
+@instrument
+def scrape_farm_data(reader="stream", workers=None, cache=False, storage=None, farm_path="FarmIncome.xlsx",
+                     va_path="VA_State_US (1).xlsx", output_path=None):
+    # ---------------------------------------------------------
+    # 1. File paths (default: the Excel files in the current folder)
+    # ---------------------------------------------------------
+    if output_path is None:
+        output_path = "FarmIncome_full.csv" if storage in (None, "csv") else f"FarmIncome_full.{storage}"
+
+    if cache:
+        # reader/workers do not change the output, so they are not in the key
+        hit = run_cached("scrape_farm_data",
+                         lambda: scrape_farm_data(reader=reader, workers=workers, storage=storage,
+                                                  farm_path=farm_path, va_path=va_path, output_path=output_path),
+                         [farm_path, va_path], [output_path], {"storage": storage})
+        if hit:
+            print(f"Cached. {output_path} is up to date.")
+        return
 
     # ---------------------------------------------------------
-    # 4. Save in the same location with a new name
+    # 2. Build ALL 48 states from the VA workbook
     # ---------------------------------------------------------
-    output_path = "FarmIncome_full.csv"
-    all_states_df.to_csv(output_path, index=False)
+    start = time.perf_counter()
+    all_states_df = build_farm_frame(farm_path, va_path, reader=reader, workers=workers)
+    elapsed = time.perf_counter() - start
+
+    # ---------------------------------------------------------
+    # 3. Save in the same location with a new name
+    # ---------------------------------------------------------
+    write_table(all_states_df, output_path, storage)
+
+    print(f"Done. Wrote {all_states_df.shape[0]} rows to {output_path} "
+          f"in {elapsed:.2f}s ({reader} reader, {workers or 1} worker(s)).")
+
+
+def compare_farm_readers(farm_path="FarmIncome.xlsx", va_path="VA_State_US (1).xlsx"):
+    """
+    Times the streaming reader next to the original per-state
+    `pd.read_excel` path and checks that both build the same table.
+
+    Returns
+    -------
+    dict
+        Seconds taken by each reader and whether the outputs match.
+    """
+    timings = {}
+    frames = {}
+    for reader in ("stream", "pandas"):
+        start = time.perf_counter()
+        frames[reader] = build_farm_frame(farm_path, va_path, reader=reader)
+        timings[reader] = time.perf_counter() - start
 
-    print(f"Done. Wrote {all_states_df.shape[0]} rows to {output_path}.")
+    same = frames["stream"].equals(frames["pandas"])
+    print(f"stream reader: {timings['stream']:.2f}s")
+    print(f"pandas reader: {timings['pandas']:.2f}s")
+    print(f"speedup: {timings['pandas'] / timings['stream']:.1f}x, identical output: {same}")
+    return {**timings, "identical": same}
 
 
 if __name__ == "__main__":
@@ -1,28 +1,477 @@
+import os
+import time
+
+import numpy as np
 import pandas as pd
-import requests
+
+from .cache import run_cached
+from .instrument import instrument
+from .storage import read_table, write_table, iter_table_chunks
+
+# NOAA climdiv layout: packed state/division/element/year code, then 12 months
+CLIMDIV_COLSPECS = [
+    (0, 2), (2, 4), (4, 6), (6, 10),
+    (10, 17), (17, 24), (24, 31), (31, 38),
+    (38, 45), (45, 52), (52, 59), (59, 66),
+    (66, 73), (73, 80), (80, 87), (87, 94)
+]
+CLIMDIV_COLS = [
+    "state", "division", "element", "year",
+    "jan","feb","mar","apr","may","jun","jul","aug",
+    "sep","oct","nov","dec"
+]
+# Missing-value sentinels: -99.99 (PDSI, PCP, ...) and -99.90 (temperatures)
+CLIMDIV_MISSING = (-99.99, -99.9)
+
+
+def _fixed_width_bytes(txt_name, width):
+    """Reads a text file into an (n_lines, width) uint8 array, NUL padded."""
+    with open(txt_name, "rb") as f:
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    return np.array(lines, dtype=f"S{width}").view(np.uint8).reshape(len(lines), width)
+
+
+def _parse_int_fields(buf):
+    """Parses an (n, k) block of right-aligned unsigned integer digits."""
+    out = np.zeros(buf.shape[0], dtype=np.int64)
+    for j in range(buf.shape[1]):
+        c = buf[:, j]
+        is_digit = (c >= 48) & (c <= 57)
+        out = np.where(is_digit, out * 10 + (c - 48), out)
+    return out
+
+
+def _parse_decimal_fields(buf):
+    """
+    Parses an (..., k) block of fixed-width decimals such as "  -0.81",
+    one character column at a time. The digits are read as an integer
+    mantissa and divided by 10**decimals, which gives the same float64 as
+    parsing the text. Empty fields are NaN.
+    """
+    shape = buf.shape[:-1]
+    mantissa = np.zeros(shape, dtype=np.int64)
+    decimals = np.zeros(shape, dtype=np.int64)
+    seen_dot = np.zeros(shape, dtype=bool)
+    negative = np.zeros(shape, dtype=bool)
+    any_digit = np.zeros(shape, dtype=bool)
+    for j in range(buf.shape[-1]):
+        c = buf[..., j]
+        is_digit = (c >= 48) & (c <= 57)
+        mantissa = np.where(is_digit, mantissa * 10 + (c - 48), mantissa)
+        decimals += is_digit & seen_dot
+        any_digit |= is_digit
+        seen_dot |= c == 46
+        negative |= c == 45
+
+    values = mantissa / 10.0 ** decimals
+    values[negative] *= -1
+    values[~any_digit] = np.nan
+    return values
+
+
+@instrument
+def read_climdiv(txt_name, colspecs=CLIMDIV_COLSPECS, cols=CLIMDIV_COLS, missing=CLIMDIV_MISSING,
+                 dtype=np.float32):
+    """
+    Fast parser for NOAA climdiv fixed-width files (e.g. rain.txt).
+
+    Splits the packed state/division/element/year code and the 12 monthly
+    fields straight into typed NumPy arrays, without `pd.read_fwf` or a
+    `pd.to_numeric` pass.
+
+    Parameters
+    ----------
+    txt_name : str
+        Path to the climdiv .txt file.
+    colspecs : list[tuple[int, int]]
+        Character spans of each field. The first four are the id fields.
+    cols : list[str]
+        Column names, same length as `colspecs`.
+    missing : tuple[float]
+        Sentinel values that are stored as NaN.
+    dtype : numpy dtype
+        Type of the value columns. float64 gives exactly the values
+        `pd.read_fwf` would.
+
+    Returns
+    -------
+    pd.DataFrame
+        int16 id columns and `dtype` value columns.
+    """
+    width = max(end for _, end in colspecs)
+    return parse_climdiv_lines(_fixed_width_bytes(txt_name, width), colspecs, cols, missing, dtype)
 
 
-def txt_to_csv(txt_name, csv_name, colspecs, cols):
-    df = pd.read_fwf(txt_name, colspecs=colspecs, names=cols)
-    df = df.apply(pd.to_numeric, errors='coerce')
-    df.to_csv(csv_name, index=False)
+@instrument
+def parse_climdiv_lines(buf, colspecs=CLIMDIV_COLSPECS, cols=CLIMDIV_COLS, missing=CLIMDIV_MISSING,
+                        dtype=np.float32):
+    """
+    Parses an (n_lines, width) uint8 array of climdiv lines (see
+    `read_climdiv`). Taking the raw bytes lets callers parse only a subset
+    of lines.
+    """
+    data = {}
+    for name, (start, end) in zip(cols[:4], colspecs[:4]):
+        data[name] = _parse_int_fields(buf[:, start:end]).astype(np.int16)
 
+    value_specs = colspecs[4:]
+    field_width = value_specs[0][1] - value_specs[0][0]
+    if all(end - start == field_width for start, end in value_specs):
+        # Equal-width month fields: gather them as one (n, 12, width) block
+        starts = np.array([start for start, _ in value_specs])
+        idx = starts[:, None] + np.arange(field_width)[None, :]
+        values = _parse_decimal_fields(buf[:, idx])
+    else:
+        values = np.column_stack([_parse_decimal_fields(buf[:, start:end]) for start, end in value_specs])
 
-def read_url_txt(url, txt_name, csv_name, colspecs, cols):
-    r = requests.get(url, timeout=30)
-    r.raise_for_status()
-    
-    if r.status_code != 200:
-        print(f"url status code is {r.status_code} not 200. Please check your url")
+    values[np.isin(values, missing)] = np.nan
+    values = values.astype(dtype)
+    for j, name in enumerate(cols[4:]):
+        data[name] = values[:, j]
+
+    return pd.DataFrame(data)
+
+
+@instrument
+def txt_to_csv(txt_name, csv_name, colspecs, cols, cache=False, engine="fwf", missing=CLIMDIV_MISSING,
+               storage=None):
+    if cache:
+        run_cached("txt_to_csv",
+                   lambda: txt_to_csv(txt_name, csv_name, colspecs, cols, engine=engine, missing=missing,
+                                      storage=storage),
+                   [txt_name], [csv_name],
+                   {"colspecs": colspecs, "cols": cols, "engine": engine, "missing": missing,
+                    "storage": storage})
+        return
+    missing = () if missing is None else missing
+    if engine == "climdiv":
+        df = read_climdiv(txt_name, colspecs, cols, missing=missing)
+    elif engine == "fwf":
+        df = pd.read_fwf(txt_name, colspecs=colspecs, names=cols)
+        df = df.apply(pd.to_numeric, errors='coerce')
+        # NOAA sentinels (-99.99) become NaN here instead of reaching yearly_avg
+        value_cols = df.select_dtypes("float").columns
+        df[value_cols] = df[value_cols].mask(df[value_cols].isin(missing))
+    else:
+        raise ValueError(f"engine must be 'fwf' or 'climdiv', not {engine!r}")
+    write_table(df, csv_name, storage)
+
+
+def compare_txt_parsers(txt_name, colspecs=CLIMDIV_COLSPECS, cols=CLIMDIV_COLS, repeat=3):
+    """
+    Times `read_climdiv` next to the `pd.read_fwf` + `pd.to_numeric` path
+    and checks that both parse the same values (sentinels aside).
+
+    Returns
+    -------
+    dict
+        Best-of-`repeat` seconds for each parser and whether they agree.
+    """
+    def fwf():
+        df = pd.read_fwf(txt_name, colspecs=colspecs, names=cols)
+        return df.apply(pd.to_numeric, errors='coerce')
+
+    timings = {}
+    frames = {}
+    for name, parse in (("climdiv", lambda: read_climdiv(txt_name, colspecs, cols)), ("fwf", fwf)):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            frames[name] = parse()
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+
+    expected = frames["fwf"].mask(frames["fwf"].isin(CLIMDIV_MISSING)).astype("float64")
+    got = frames["climdiv"].astype("float64")
+    # float32 storage keeps ~7 significant digits
+    same = bool(np.allclose(got.to_numpy(), expected.to_numpy(), rtol=1e-6, atol=1e-6, equal_nan=True))
+    print(f"climdiv parser: {timings['climdiv']:.3f}s")
+    print(f"read_fwf path:  {timings['fwf']:.3f}s")
+    print(f"speedup: {timings['fwf'] / timings['climdiv']:.1f}x, same values: {same}")
+    return {**timings, "same_values": same}
+
+
+@instrument
+def read_url_txt(url, txt_name, csv_name, colspecs, cols, cache=False, missing=CLIMDIV_MISSING, storage=None):
+    # Streams to disk in chunks, with retries and ETag/Last-Modified checks
+    from .download import download_file
+    download_file(url, txt_name)
+    txt_to_csv(txt_name, csv_name, colspecs, cols, cache=cache, missing=missing, storage=storage)
+
+
+@instrument
+def normalized_data(df_to_read, new_col_name, csv_name_clean, months, groups, cache=False, chunksize=None,
+                    count_col="n_months", min_months=1, storage=None):
+    if cache:
+        run_cached("normalized_data",
+                   lambda: normalized_data(df_to_read, new_col_name, csv_name_clean, months, groups,
+                                           chunksize=chunksize, count_col=count_col, min_months=min_months,
+                                           storage=storage),
+                   [df_to_read], [csv_name_clean],
+                   {"new_col_name": new_col_name, "months": months, "groups": groups,
+                    "count_col": count_col, "min_months": min_months, "storage": storage})
+        return
+    if chunksize is not None:
+        state_precip = _streamed_group_mean(df_to_read, new_col_name, months, groups, chunksize,
+                                            count_col, min_months)
+        write_table(state_precip.reset_index(), csv_name_clean, storage)
         return
-    with open(txt_name, "wb") as f:
-        f.write(r.content)
-    from farm_precip_project import txt_to_csv
-    txt_to_csv(txt_name, csv_name, colspecs, cols)
+    df = read_table(df_to_read, columns=list(groups) + list(months))
+    state_precip = _group_mean(df, new_col_name, months, groups, count_col, min_months)
+    write_table(state_precip.reset_index(), csv_name_clean, storage)
 
 
-def normalized_data(df_to_read, new_col_name, csv_name_clean, months, groups):
-    df = pd.read_csv(df_to_read)
-    df[new_col_name] = df[months].mean(axis=1)
+def _group_mean(df, new_col_name, months, groups, count_col="n_months", min_months=1):
+    """In-memory per-group average of the valid months (see normalized_data)."""
+    row_avg, valid_months = _valid_month_mean(df, months, min_months)
+    df = df.assign(**{new_col_name: row_avg})
     state_precip = df.groupby(groups)[new_col_name].mean()
-    state_precip.to_csv(csv_name_clean)
\ No newline at end of file
+    if count_col is not None:
+        # Fewest valid months of any division in the (state, year)
+        state_precip = state_precip.to_frame()
+        state_precip[count_col] = pd.Series(valid_months, index=df.index).groupby(
+            [df[g] for g in groups]).min()
+    return state_precip
+
+
+def _valid_month_mean(df, months, min_months):
+    """
+    Per-row mean over the valid (non-NaN) months and the number of valid
+    months. Missing months are NaN (see txt_to_csv), so NOAA's -99.99
+    sentinel never reaches the average. Rows with fewer than `min_months`
+    valid months get NaN. Each row is reduced on its own, so the result
+    does not depend on how the file is chunked.
+    """
+    values = df[months].to_numpy(dtype=np.float64)
+    valid_months = np.count_nonzero(~np.isnan(values), axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        row_avg = np.nansum(values, axis=1) / valid_months
+    row_avg[valid_months < max(min_months, 1)] = np.nan
+    return row_avg, valid_months
+
+
+def _streamed_group_mean(df_to_read, new_col_name, months, groups, chunksize, count_col=None, min_months=1):
+    """
+    Same result as the in-memory groupby mean in `normalized_data`, but reads
+    `chunksize` rows at a time and only keeps running per-group sums and
+    counts, so memory is bounded by the number of groups, not the file size.
+
+    The sums use the same Kahan-compensated update, in the same row order,
+    as pandas' groupby mean, so the written CSV is byte-identical.
+    """
+    keys = pd.MultiIndex.from_arrays([[]] * len(groups), names=groups)
+    sums = np.zeros(0)
+    comp = np.zeros(0)
+    counts = np.zeros(0, dtype=np.int64)
+    fewest = np.zeros(0, dtype=np.int64)
+
+    for chunk in iter_table_chunks(df_to_read, chunksize, columns=list(groups) + list(months)):
+        values, valid_months = _valid_month_mean(chunk, months, min_months)
+        chunk_keys = pd.MultiIndex.from_frame(chunk[groups])
+        key_dtypes = chunk[groups].dtypes
+
+        new_keys = chunk_keys.unique().difference(keys, sort=False)
+        if len(new_keys):
+            keys = keys.append(new_keys)
+            pad = len(new_keys)
+            sums = np.concatenate([sums, np.zeros(pad)])
+            comp = np.concatenate([comp, np.zeros(pad)])
+            counts = np.concatenate([counts, np.zeros(pad, dtype=np.int64)])
+            fewest = np.concatenate([fewest, np.full(pad, len(months), dtype=np.int64)])
+        pos = keys.get_indexer(chunk_keys)
+        np.minimum.at(fewest, pos, valid_months)
+
+        # k-th row of every group in this chunk, updated together for each k
+        rank = pd.Series(pos).groupby(pos).cumcount().to_numpy()
+        valid = ~np.isnan(values)
+        for k in range(rank.max() + 1 if len(rank) else 0):
+            sel = valid & (rank == k)
+            p, v = pos[sel], values[sel]
+            y = v - comp[p]
+            t = sums[p] + y
+            c = t - sums[p] - y
+            comp[p] = np.where(np.isnan(c), 0.0, c)
+            sums[p] = t
+            counts[p] += 1
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    if len(keys):
+        # Keep the input's key dtypes (e.g. int16 state/year from Parquet)
+        keys = pd.MultiIndex.from_frame(keys.to_frame(index=False).astype(key_dtypes))
+    state_precip = pd.Series(means, index=keys, name=new_col_name)
+    if count_col is not None:
+        state_precip = state_precip.to_frame()
+        state_precip[count_col] = fewest
+    return state_precip.sort_index()
+
+
+# ---------------------------------------------------------
+# Area-weighted multi-element ingest
+# ---------------------------------------------------------
+# NOAA climdiv element codes (the 5th-6th characters of each line) -> the
+# short names used for the output columns
+CLIMDIV_ELEMENTS = {
+    1: "pcpn", 2: "tmpc", 5: "pdsi", 6: "phdi", 7: "zndx", 8: "pmdi",
+    25: "hddc", 26: "cddc", 27: "tmax", 28: "tmin",
+    71: "sp01", 72: "sp02", 73: "sp03", 74: "sp06", 75: "sp09", 76: "sp12", 77: "sp24",
+}
+
+
+def _division_weight_lookup(weights, weight_col):
+    """
+    Dense (state * 100 + division) -> weight array from a lookup table, so
+    every row's weight is one fancy-indexing step. Divisions not in the
+    table are NaN.
+    """
+    if not isinstance(weights, pd.DataFrame):
+        weights = read_table(weights)
+    missing_cols = {"state", "division", weight_col} - set(weights.columns)
+    if missing_cols:
+        raise ValueError(f"weights table needs columns state, division and {weight_col}; "
+                         f"missing {sorted(missing_cols)}")
+    w = weights[weight_col].to_numpy(dtype=np.float64)
+    if np.any(w < 0) or np.any(np.isnan(w)):
+        raise ValueError(f"weights in {weight_col!r} must be non-negative numbers")
+    lookup = np.full(100 * 100, np.nan)
+    lookup[weights["state"].to_numpy(dtype=np.int64) * 100 + weights["division"].to_numpy(dtype=np.int64)] = w
+    return lookup
+
+
+@instrument
+def weighted_state_features(df, weights=None, weight_col="weight", months=CLIMDIV_COLS[4:], min_months=1,
+                            count_col="n_months", monthly=False):
+    """
+    Weighted state x year averages of division-level climdiv records, one
+    block of columns per element.
+
+    Each division-year is first reduced to its mean over valid months (as
+    in `normalized_data`); the state value is the weighted mean of those
+    over the divisions with a valid value. All sums come from one sort and
+    one `np.add.reduceat` over a stacked (rows, features) array, so the
+    cost does not depend on the number of divisions or elements.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Division-level table with state, division, element, year and the
+        month columns (e.g. `read_climdiv` output or rain_dirty.csv).
+    weights : pd.DataFrame, str or None
+        Lookup table with state, division and `weight_col` columns, e.g.
+        division land area or cropland acres. None weights every division
+        equally, which gives the same values as `normalized_data`.
+    weight_col : str
+        Weight column of the lookup table.
+    months : list[str]
+        Month columns.
+    min_months : int
+        Division-years with fewer valid months are left out.
+    count_col : str or None
+        If given, adds "<element>_<count_col>": the fewest valid months of
+        any division in the (state, year).
+    monthly : bool
+        Also add weighted monthly means as "<element>_<month>" columns.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per (state, year). Column "<element>" is the weighted
+        yearly average (named from CLIMDIV_ELEMENTS, e.g. "pdsi").
+    """
+    months = list(months)
+    state = df["state"].to_numpy(dtype=np.int64)
+    division = df["division"].to_numpy(dtype=np.int64)
+    element = df["element"].to_numpy(dtype=np.int64)
+    year = df["year"].to_numpy(dtype=np.int64)
+
+    if weights is None:
+        w = np.ones(len(df))
+    else:
+        w = _division_weight_lookup(weights, weight_col)[state * 100 + division]
+        unknown = np.isnan(w)
+        if unknown.any():
+            pairs = sorted(set(zip(state[unknown].tolist(), division[unknown].tolist())))
+            raise ValueError(f"{len(pairs)} (state, division) pairs have no weight, e.g. {pairs[:5]}")
+
+    row_avg, valid_months = _valid_month_mean(df, months, min_months)
+    has_avg = ~np.isnan(row_avg)
+    # Numerator and denominator of every weighted mean, side by side
+    columns = [np.where(has_avg, w * row_avg, 0.0), np.where(has_avg, w, 0.0)]
+    if monthly:
+        values = df[months].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        columns += [np.where(valid, w[:, None] * values, 0.0), np.where(valid, w[:, None], 0.0)]
+    block = np.column_stack(columns)
+
+    # One packed key per (element, state, year), then one sorted reduce
+    key = (element * 100 + state) * 10_000 + year
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    sums = np.add.reduceat(block[order], starts, axis=0)
+    fewest = np.minimum.reduceat(valid_months[order], starts)
+
+    n = len(months)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        long = {"": sums[:, 0] / sums[:, 1]}
+        if monthly:
+            long.update(zip([f"_{m}" for m in months], (sums[:, 2:2 + n] / sums[:, 2 + n:2 + 2 * n]).T))
+    if count_col is not None:
+        long[f"_{count_col}"] = fewest
+
+    key = key[starts]
+    index = pd.MultiIndex.from_arrays(
+        [key // 10_000 % 100, key % 10_000, key // 1_000_000], names=["state", "year", "element"])
+    wide = pd.DataFrame(long, index=index).unstack("element")
+    # Group the columns by element: pdsi, pdsi_jan, ..., pcpn, pcpn_jan, ...
+    wide = wide[[(f, e) for e in wide.columns.levels[1] for f in long]]
+    wide.columns = [f"{CLIMDIV_ELEMENTS.get(e, f'element_{e}')}{f}" for f, e in wide.columns]
+    return wide.reset_index()
+
+
+@instrument
+def ingest_climdiv(txt_names, out_name=None, weights=None, weight_col="weight", min_months=1,
+                   count_col="n_months", monthly=False, cache=False, storage=None):
+    """
+    Reads one or more climdiv .txt files (e.g. the PDSI, precipitation and
+    temperature files) and writes the weighted state x year features of
+    every element they contain (see `weighted_state_features`).
+
+    Parameters
+    ----------
+    txt_names : str or list[str]
+        Climdiv files; their lines are parsed together in one pass.
+    out_name : str or None
+        If given, the wide table is written there.
+    weights, weight_col, min_months, count_col, monthly
+        Passed to `weighted_state_features`.
+    cache : bool
+        Reuse the written table until the input files (and weights file)
+        or arguments change. Needs `out_name`.
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    txt_names = [txt_names] if isinstance(txt_names, (str, os.PathLike)) else list(txt_names)
+    if cache:
+        if out_name is None or isinstance(weights, pd.DataFrame):
+            raise ValueError("cache=True needs an out_name and weights given as a file path (or None)")
+        result = {}
+        hit = run_cached(
+            "ingest_climdiv",
+            lambda: result.setdefault("df", ingest_climdiv(
+                txt_names, out_name, weights, weight_col, min_months, count_col, monthly, storage=storage)),
+            txt_names + ([weights] if weights is not None else []), [out_name],
+            {"weight_col": weight_col, "min_months": min_months, "count_col": count_col,
+             "monthly": monthly, "storage": storage},
+        )
+        return read_table(out_name, storage=storage) if hit else result["df"]
+
+    width = max(end for _, end in CLIMDIV_COLSPECS)
+    buf = np.concatenate([_fixed_width_bytes(name, width) for name in txt_names])
+    df = parse_climdiv_lines(buf, dtype=np.float64)
+    wide = weighted_state_features(df, weights, weight_col, CLIMDIV_COLS[4:], min_months, count_col, monthly)
+    if out_name is not None:
+        write_table(wide, out_name, storage)
+    return wide
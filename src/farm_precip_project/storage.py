@@ -0,0 +1,125 @@
+import os
+
+import pandas as pd
+
+from .instrument import add_rows
+
+# Storage backends for the intermediate tables. "csv" stays the default;
+# "parquet" and "feather" keep dtypes (int state/year, float64 values) and
+# allow column projection without parsing text. Both need pyarrow.
+STORAGE_FORMATS = ("csv", "parquet", "feather")
+
+_EXTENSIONS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+}
+
+
+def storage_format(path, storage=None):
+    """
+    Returns the backend for `path`, guessed from the file extension
+    (anything unknown is treated as CSV).
+
+    An explicit `storage` must agree with that guess: a Parquet file named
+    "merged.csv" would later be parsed as CSV by `read_table(path)`, so it
+    raises ValueError instead.
+    """
+    guessed = _EXTENSIONS.get(os.path.splitext(str(path))[1].lower(), "csv")
+    if storage is None:
+        storage = guessed
+    if storage not in STORAGE_FORMATS:
+        raise ValueError(f"storage must be one of {STORAGE_FORMATS}, not {storage!r}")
+    if storage != guessed:
+        raise ValueError(f"storage={storage!r} does not match the extension of {str(path)!r} "
+                         f"(read as {guessed!r}); name the file with a .{storage} suffix")
+    return storage
+
+
+def _require_pyarrow(storage):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError(
+            f"storage={storage!r} needs pyarrow (installed with streamlit): pip install pyarrow"
+        ) from e
+
+
+def write_table(df, path, storage=None):
+    """
+    Writes `df` (without its index) to `path` in the chosen backend.
+    """
+    storage = storage_format(path, storage)
+    add_rows(rows_out=len(df))
+    if storage == "csv":
+        df.to_csv(path, index=False)
+        return
+    _require_pyarrow(storage)
+    df = df.reset_index(drop=True)
+    if storage == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_feather(path)
+
+
+def read_table(path, columns=None, storage=None, exact=False):
+    """
+    Reads a table written by `write_table`.
+
+    Parameters
+    ----------
+    path : str
+        File to read.
+    columns : list[str] or None
+        Only load these columns, in this order (e.g. ["state", "year",
+        "yearly_avg", "Crop cash receipts"]). None loads everything.
+    storage : str or None
+        "csv", "parquet" or "feather"; None guesses from the extension.
+    exact : bool
+        CSV only: parse floats so they round-trip exactly. pandas' default
+        parser can be off by one ulp, which shows up when a table is read
+        and written back (e.g. by an upsert).
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    storage = storage_format(path, storage)
+    columns = None if columns is None else list(columns)
+    if storage == "csv":
+        df = pd.read_csv(path, usecols=columns, float_precision="round_trip" if exact else None)
+    else:
+        _require_pyarrow(storage)
+        if storage == "parquet":
+            df = pd.read_parquet(path, columns=columns)
+        else:
+            df = pd.read_feather(path, columns=columns)
+    add_rows(rows_in=len(df))
+    return df if columns is None else df[columns]
+
+
+def iter_table_chunks(path, chunksize, columns=None, storage=None):
+    """
+    Yields DataFrames of at most `chunksize` rows, so large inputs can be
+    reduced without loading them whole.
+    """
+    storage = storage_format(path, storage)
+    columns = None if columns is None else list(columns)
+    if storage == "csv":
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=chunksize):
+            add_rows(rows_in=len(chunk))
+            yield chunk
+        return
+    _require_pyarrow(storage)
+    if storage == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            add_rows(rows_in=batch.num_rows)
+            yield batch.to_pandas()
+    else:
+        # No batch reader for Feather: load the projected columns once and slice
+        df = read_table(path, columns=columns, storage=storage)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize]
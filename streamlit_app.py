@@ -1,6 +1,12 @@
+import io
+import os
+import threading
+import time
+
 import streamlit as st
 import pandas as pd
 import farm_precip_project as fpp
+import matplotlib
 import matplotlib.pyplot as plt
 import seaborn as sns
 from farm_precip_project import (
@@ -8,70 +14,159 @@ from farm_precip_project import (
     make_scatter_w_cat,
     precip_trend_figure,
     crop_income_fig,
-    remove_outliers,
     corr_and_plot,
-    center_column
+    enable_instrumentation,
+    disable_instrumentation,
+    instrumentation_enabled,
+    instrumentation_summary,
+    reset_instrumentation,
+    transform,
 )
 
+matplotlib.use("Agg")
 
 # # https://farmprecipproject-overview.streamlit.app/
 
+# ---------------------------------------------------------
+# Cached data layer
+# ---------------------------------------------------------
+# Everything below is shared by all sessions and reruns. The merged data
+# is keyed on the input files' mtime and size, so it is rebuilt only when
+# a CSV changes; derived frames and figures are keyed on that same stamp
+# plus their own parameters.
+
+csvs = ["FarmIncome_full.csv", "rain_clean.csv"]
+group_on = ("state", "year")
+
+
+def file_stamp(paths):
+    return tuple((p, os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in paths)
+
+
+@st.cache_resource
+def _debug_state():
+    # Cache misses per step (bumped inside the cached functions) and the
+    # slowest (cold) timing seen per step, shared across sessions
+    return {"misses": {}, "cold": {}, "lock": threading.Lock()}
+
+
+def _miss(step):
+    misses = _debug_state()["misses"]
+    misses[step] = misses.get(step, 0) + 1
+
+
+@st.cache_data(show_spinner=False)
+def load_merged(stamp, group_on):
+    _miss("merge")
+    # Merge in memory: no combined CSV is written and read back
+    return merge_csvs(None, [p for p, _, _ in stamp], list(group_on))
+
+
+@st.cache_resource
+def shared_merged(stamp, group_on):
+    # One read-only frame for transform plans: cache_data hands out a new
+    # copy per call, which would defeat the plans' per-frame group codes
+    return load_merged(stamp, group_on)
+
+
+@st.cache_data(show_spinner=False)
+def centered_frame(stamp, group_on, col_name, col_group, col_stand_name):
+    _miss("center")
+    # Lazy plan over the shared frame: no copy of it is modified, and the
+    # memoized state group codes are reused when only the columns change
+    return transform(shared_merged(stamp, group_on)).center(col_name, col_group, col_stand_name).run(memo=True)
+
+
+_PLOTTERS = {
+    "precip_trend": lambda df, args: precip_trend_figure(df, *args),
+    "crop_income": lambda df, args: crop_income_fig(df, *args),
+    "corr": lambda df, args: corr_and_plot(df, *args),
+    "scatter_by_cat": lambda df, args: make_scatter_w_cat(df, *args),
+}
+
+
+@st.cache_data(show_spinner=False)
+def render_png(kind, stamp, group_on, args, centered=None):
+    """PNG bytes of one figure, cached by its kind, arguments and data stamp."""
+    _miss(kind)
+    df = load_merged(stamp, group_on) if centered is None else centered_frame(stamp, group_on, *centered)
+    # pyplot keeps global state, so sessions take turns drawing
+    with _debug_state()["lock"]:
+        plt.close("all")
+        fig = _PLOTTERS[kind](df, args)
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=150)
+        plt.close("all")
+    return buf.getvalue()
+
+
+timings = []
+
+
+def timed(step, func, *args, **kwargs):
+    misses = _debug_state()["misses"]
+    before = misses.get(step, 0)
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    cold = misses.get(step, 0) > before
+    if cold:
+        _debug_state()["cold"][step] = elapsed
+    timings.append((step, "cold" if cold else "warm", elapsed))
+    return result
+
+
+# Opt-in per-call records (wall, CPU, memory, rows, bytes) of the package
+# functions; only uncached steps call into the package. Recording is shared
+# by every session in this server process, so a session's checkbox only
+# turns it on; "Stop recording" is the one way to turn it off for everyone.
+def _stop_recording():
+    disable_instrumentation()
+    st.session_state["record_calls"] = False
+
+
+instrument_panel = st.sidebar.expander("Debug: instrumentation")
+if instrument_panel.checkbox("Record package calls", key="record_calls") and not instrumentation_enabled():
+    enable_instrumentation()
+
+run_start = time.perf_counter()
+stamp = file_stamp(csvs)
+
 st.title("State Farm Precipitation and Income Data Analysis")
 st.subheader("Highlights of an analysis performed using the farm_precip_project package")
 
 
 st.write("After scraping, cleaning, and merging the data, we have the following table:")
 
-csvs = ["FarmIncome_full.csv", "rain_clean.csv"]
-group_on = ["state", "year"]
-new_csv_name = "combined_farm_precip.csv"
-
-merge_csvs(new_csv_name, csvs, group_on)
+merged = timed("merge", load_merged, stamp, group_on)
 
-st.markdown(pd.read_csv(new_csv_name).head(5).to_markdown())
+st.markdown(merged.head(5).to_markdown())
 
-st.write("After removing outliers from the data, we can visualize the correlation between yearly average precipitation and farm income:")
+st.write("NOAA's -99.99 missing values are dropped while parsing, so yearly averages only use valid months and no outlier filtering is needed before we visualize the correlation between yearly average precipitation and farm income:")
 
 st.header("EDA")
 
-df = pd.read_csv("combined_farm_precip.csv")
-
 group_by = "year"
 titles = ["Year", "Mean Normalized Precipitation", "Average Precipitation Across the U.S. Over Time"]
-plot = precip_trend_figure(df, group_by,titles)
-st.pyplot(plot)
-
-plt.close()
+st.image(timed("precip_trend", render_png, "precip_trend", stamp, group_on, (group_by, tuple(titles))))
 
-st.write("We see that PDSI is stable over time, the only error is the data provided in 2014, which we will remove before analysis.")
+st.write("We see that PDSI is stable over time. 2014 only has a January value, so its yearly average is built from that single valid month (see the n_months column).")
 
 
 group_by2 = "year"
 titles2 = ["Year", "Mean Crop Cash Receipts", "Crop Income Trends Over Time"]
-plot2 = crop_income_fig(df, group_by2, titles2)
-st.pyplot(plot2)
-
-plt.close()
+st.image(timed("crop_income", render_png, "crop_income", stamp, group_on, (group_by2, tuple(titles2))))
 
 st.write("Crop income has been steadily increasing over time, which we will have to be aware of during our analysis.")
 
 st.header("Analysis of PDSI vs. Income")
 
-df = pd.read_csv('combined_farm_precip.csv')
-col_name = "yearly_avg"
-threshold = -50
-
-df = remove_outliers(df, col_name, threshold, lower = True)
-
 colx = "yearly_avg"
 coly = "Value of crop production"
 plot_file = f"plot_{colx}_vs_{coly}.png"
 n_digits = 4
 
-plot3 = corr_and_plot(df, colx, coly, plot_file,n_digits)
-st.pyplot(plot3)
-
-plt.close()
+st.image(timed("corr", render_png, "corr", stamp, group_on, (colx, coly, plot_file, n_digits)))
 
 st.write("We see little to no correlation between PDSI and crop income when the income is not normalized by state. " \
 "This demonstrates that PDSI by itself does not accurately predict crop income. " \
@@ -80,8 +175,9 @@ st.write("We see little to no correlation between PDSI and crop income when the
 col_name = "yearly_avg"
 col_group = "state"
 col_stand_name = "income_centered"
+centered = (col_name, col_group, col_stand_name)
 
-df = center_column(df, col_name, col_group, col_stand_name)
+df = timed("center", centered_frame, stamp, group_on, *centered)
 
 # colx = "yearly_avg"
 # coly = "income_centered"
@@ -97,9 +193,37 @@ coly = "income_centered"
 colcat = "state"
 plot_file = f"plot_{colx}_vs_{coly}_by_{colcat}.png"
 
-
-plot5 = make_scatter_w_cat(df, colx, coly, colcat, plot_file)
-st.pyplot(plot5)
+st.image(timed("scatter_by_cat", render_png, "scatter_by_cat", stamp, group_on,
+               (colx, coly, colcat, plot_file), centered=centered))
 
 st.write("We can see that each state's data is roughly linear with a different intercept, which is why centering the income by state was important. " \
 "This further confirms that there is a relationship between PDSI and crop income when accounting for state")
+
+# ---------------------------------------------------------
+# Debug panel: this rerun vs the cold (uncached) timings
+# ---------------------------------------------------------
+with st.sidebar.expander("Debug: cache timing"):
+    cold = _debug_state()["cold"]
+    st.dataframe(pd.DataFrame(
+        [(step, status, f"{elapsed * 1000:.1f}", f"{cold[step] * 1000:.1f}" if step in cold else "")
+         for step, status, elapsed in timings],
+        columns=["step", "this rerun", "ms", "cold ms"],
+    ))
+    st.write(f"Rerun total: {(time.perf_counter() - run_start) * 1000:.1f} ms "
+             f"(cold total: {sum(cold.values()) * 1000:.1f} ms)")
+    if st.button("Clear cache"):
+        st.cache_data.clear()
+        cold.clear()
+        st.rerun()
+
+with instrument_panel:
+    summary = instrumentation_summary()
+    if summary.empty:
+        st.write("No calls recorded. Cached steps do not call the package; clear the cache to re-run them.")
+    else:
+        st.dataframe(summary)
+    if st.button("Reset records"):
+        reset_instrumentation()
+        st.rerun()
+    if instrumentation_enabled():
+        st.button("Stop recording (all sessions)", on_click=_stop_recording)
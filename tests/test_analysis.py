@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pandas.testing as tm
+import pytest
+
+from farm_precip_project.analysis import center_column, clear_transform_cache, remove_outliers, transform
+
+COMBINED = os.path.join(os.path.dirname(__file__), "..", "combined_farm_precip.csv")
+INCOME = "Crop cash receipts"
+
+
+@pytest.fixture
+def df():
+    clear_transform_cache()
+    return pd.read_csv(COMBINED)
+
+
+def test_editing_a_result_does_not_change_later_results(df):
+    a = remove_outliers(df, "yearly_avg", 0)
+    expected = a.copy()
+    a.loc[a.index[0], "yearly_avg"] = 12345
+    tm.assert_frame_equal(remove_outliers(df, "yearly_avg", 0), expected)
+
+    plan = transform(df).filter("yearly_avg", ">", 0).center(INCOME, "state", "c")
+    first = plan.run(memo=True)
+    expected = first.copy()
+    first.loc[first.index[0], "c"] = 12345
+    tm.assert_frame_equal(plan.run(memo=True), expected)
+
+
+@pytest.mark.parametrize("edit", ["loc", "values"])
+def test_editing_the_base_frame_is_seen(df, edit):
+    plan = transform(df).filter("yearly_avg", ">", 0).center(INCOME, "state", "c")
+    remove_outliers(df, "yearly_avg", 0)
+    plan.run(memo=True)
+
+    rows = df.index[df["yearly_avg"] <= 0][:200]
+    if edit == "loc":
+        df.loc[rows, "yearly_avg"] = 1.0
+    else:
+        df["yearly_avg"].values[rows] = 1.0
+    df.loc[df.index[0], INCOME] += 1e6
+
+    tm.assert_frame_equal(remove_outliers(df, "yearly_avg", 0), df[df["yearly_avg"] > 0])
+    kept = df[df["yearly_avg"] > 0]
+    expected = kept[INCOME] - kept.groupby("state")[INCOME].transform("mean")
+    np.testing.assert_allclose(plan.run(memo=True)["c"], expected, rtol=1e-12, atol=1e-6)
+    tm.assert_frame_equal(plan.run(memo=True), plan.run())
+
+
+def test_center_column_keeps_pandas_means_and_adds_to_df(df):
+    expected = df[INCOME] - df.groupby("state")[INCOME].transform("mean")
+    out = center_column(df, INCOME, "state", "income_centered")
+    assert out is df
+    tm.assert_series_equal(df["income_centered"], expected, check_names=False, check_exact=True)
+
+
+def test_plan_matches_pandas(df):
+    out = (transform(df)
+           .filter("yearly_avg", ">", -10)
+           .standardize(INCOME, ["state"], "z")
+           .select(["state", "year", "z"])
+           .run())
+    kept = df[df["yearly_avg"] > -10]
+    g = kept.groupby("state")[INCOME]
+    expected = (kept[INCOME] - g.transform("mean")) / g.transform("std")
+    assert list(out.columns) == ["state", "year", "z"]
+    tm.assert_index_equal(out.index, kept.index)
+    np.testing.assert_allclose(out["z"], expected, rtol=1e-12, atol=1e-12)
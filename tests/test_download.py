@@ -0,0 +1,194 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+import requests
+
+from farm_precip_project import download
+from farm_precip_project.download import download_file, download_many, refresh_txt_files
+from farm_precip_project.scrape_precip import CLIMDIV_COLS, CLIMDIV_COLSPECS, txt_to_csv
+
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+# ---------------------------------------------------------
+# Local HTTP stand-in for the NOAA server
+# ---------------------------------------------------------
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        srv = self.server
+        srv.seen.append(dict(self.headers))
+        if srv.failures:
+            srv.failures -= 1
+            self._reply(503)
+            return
+        body = srv.files[self.path]
+        etag = f'"{hashlib.md5(body).hexdigest()}"' if srv.send_etag else None
+        validator = etag or LAST_MODIFIED
+        if (etag and self.headers.get("If-None-Match") == etag) or \
+                (not etag and self.headers.get("If-Modified-Since") == LAST_MODIFIED):
+            self._reply(304)
+            return
+        rng = self.headers.get("Range")
+        if rng and self.headers.get("If-Range") == validator:
+            start = int(rng.removeprefix("bytes=").rstrip("-"))
+            if start >= len(body):
+                self._reply(416)
+                return
+            self._reply(206, body[start:], etag, {"Content-Range": f"bytes {start}-{len(body) - 1}/{len(body)}"})
+            return
+        self._reply(200, body, etag)
+
+    def _reply(self, status, body=b"", etag=None, extra=None):
+        self.server.statuses.append(status)
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        for key, value in (extra or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    srv.files = {"/data.txt": b"0123456789" * 1000}
+    srv.seen, srv.statuses = [], []
+    srv.failures = 0
+    srv.send_etag = True
+    srv.url = f"http://127.0.0.1:{srv.server_address[1]}"
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    waits = []
+    monkeypatch.setattr(download.time, "sleep", waits.append)
+    return waits
+
+
+# ---------------------------------------------------------
+# download_file
+# ---------------------------------------------------------
+def test_plain_download(server, tmp_path):
+    path = tmp_path / "data.txt"
+    assert download_file(server.url + "/data.txt", str(path)) == "downloaded"
+    assert path.read_bytes() == server.files["/data.txt"]
+    assert not os.path.exists(f"{path}.part")
+    assert server.statuses == [200]
+
+
+@pytest.mark.parametrize("send_etag", [True, False])
+def test_conditional_get_returns_unchanged(server, tmp_path, send_etag):
+    server.send_etag = send_etag
+    path = tmp_path / "data.txt"
+    download_file(server.url + "/data.txt", str(path))
+    mtime = os.path.getmtime(path)
+
+    assert download_file(server.url + "/data.txt", str(path)) == "unchanged"
+    assert server.statuses == [200, 304]
+    header = "If-None-Match" if send_etag else "If-Modified-Since"
+    assert header in server.seen[-1]
+    assert os.path.getmtime(path) == mtime
+
+
+def test_resumes_partial_file_with_range(server, tmp_path):
+    body = server.files["/data.txt"]
+    path = tmp_path / "data.txt"
+    # A first attempt that stopped half way
+    download_file(server.url + "/data.txt", str(path))
+    os.replace(path, f"{path}.part")
+    os.replace(f"{path}.meta.json", f"{path}.part.meta.json")
+    with open(f"{path}.part", "r+b") as f:
+        f.truncate(len(body) // 2)
+
+    assert download_file(server.url + "/data.txt", str(path)) == "downloaded"
+    assert server.seen[-1]["Range"] == f"bytes={len(body) // 2}-"
+    assert server.statuses[-1] == 206
+    assert path.read_bytes() == body
+
+
+def _stale_partial(server, path):
+    # A partial file longer than the source, so resuming it gets a 416
+    download_file(server.url + "/data.txt", str(path))
+    os.replace(f"{path}.meta.json", f"{path}.part.meta.json")
+    os.replace(path, f"{path}.part")
+    with open(f"{path}.part", "ab") as f:
+        f.write(b"stale")
+
+
+def test_416_starts_over(server, tmp_path, no_sleep):
+    path = tmp_path / "data.txt"
+    _stale_partial(server, path)
+    assert download_file(server.url + "/data.txt", str(path), retries=1) == "downloaded"
+    assert server.statuses[-2:] == [416, 200]
+    assert path.read_bytes() == server.files["/data.txt"]
+
+
+def test_416_on_last_attempt_raises(server, tmp_path, no_sleep):
+    path = tmp_path / "data.txt"
+    _stale_partial(server, path)
+    with pytest.raises(requests.HTTPError, match="416"):
+        download_file(server.url + "/data.txt", str(path), retries=0)
+    assert not path.exists() and not os.path.exists(f"{path}.part")
+
+
+def test_retries_5xx_with_backoff(server, tmp_path, no_sleep):
+    server.failures = 2
+    path = tmp_path / "data.txt"
+    assert download_file(server.url + "/data.txt", str(path), retries=3, backoff=0.5) == "downloaded"
+    assert server.statuses == [503, 503, 200]
+    assert no_sleep == [0.5, 1.0]
+    assert path.read_bytes() == server.files["/data.txt"]
+
+
+def test_gives_up_after_retries(server, tmp_path, no_sleep):
+    server.failures = 10
+    with pytest.raises(requests.HTTPError, match="503"):
+        download_file(server.url + "/data.txt", str(tmp_path / "data.txt"), retries=2, backoff=1)
+    assert server.statuses == [503, 503, 503]
+    assert no_sleep == [1, 2]
+
+
+# ---------------------------------------------------------
+# download_many / refresh_txt_files
+# ---------------------------------------------------------
+def test_download_many_calls_back_per_file(server, tmp_path):
+    server.files["/other.txt"] = b"other"
+    jobs = [(server.url + "/data.txt", str(tmp_path / "a.txt")),
+            (server.url + "/other.txt", str(tmp_path / "b.txt"))]
+    done = []
+    results = download_many(jobs, workers=2, on_complete=lambda url, path, status: done.append((path, status)))
+    assert results == {str(tmp_path / "a.txt"): "downloaded", str(tmp_path / "b.txt"): "downloaded"}
+    assert sorted(done) == sorted(results.items())
+    assert (tmp_path / "b.txt").read_bytes() == b"other"
+
+
+def test_refresh_hands_each_file_to_txt_to_csv(server, tmp_path):
+    with open(os.path.join(os.path.dirname(__file__), "..", "rain.txt"), "rb") as f:
+        server.files["/pdsi.txt"] = b"".join(f.readlines()[:50])
+    txt, csv = str(tmp_path / "pdsi.txt"), str(tmp_path / "pdsi.csv")
+    jobs = [(server.url + "/pdsi.txt", txt, csv)]
+
+    assert refresh_txt_files(jobs, CLIMDIV_COLSPECS, CLIMDIV_COLS) == {txt: "downloaded"}
+    expected = str(tmp_path / "expected.csv")
+    txt_to_csv(txt, expected, CLIMDIV_COLSPECS, CLIMDIV_COLS)
+    pd.testing.assert_frame_equal(pd.read_csv(csv), pd.read_csv(expected))
+
+    # Unchanged download: the existing CSV is not rebuilt
+    mtime = os.path.getmtime(csv)
+    assert refresh_txt_files(jobs, CLIMDIV_COLSPECS, CLIMDIV_COLS) == {txt: "unchanged"}
+    assert os.path.getmtime(csv) == mtime
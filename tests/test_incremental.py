@@ -0,0 +1,56 @@
+import os
+
+import pandas as pd
+
+from farm_precip_project.incremental import refresh_rain_clean
+from farm_precip_project.scrape_precip import CLIMDIV_COLS, CLIMDIV_COLSPECS, normalized_data, txt_to_csv
+
+RAIN_TXT = os.path.join(os.path.dirname(__file__), "..", "rain.txt")
+
+
+def _lines(n=300):
+    with open(RAIN_TXT) as f:
+        return [next(f) for _ in range(n)]
+
+
+def _full_rebuild(txt, tmp_path):
+    dirty, clean = str(tmp_path / "dirty.csv"), str(tmp_path / "full.csv")
+    txt_to_csv(txt, dirty, CLIMDIV_COLSPECS, CLIMDIV_COLS)
+    normalized_data(dirty, "yearly_avg", clean, CLIMDIV_COLS[4:], ["state", "year"])
+    return pd.read_csv(clean)
+
+
+def _refresh(lines, tmp_path):
+    txt, clean = tmp_path / "rain.txt", str(tmp_path / "rain_clean.csv")
+    txt.write_text("".join(lines))
+    changed, _ = refresh_rain_clean(str(txt), clean)
+    pd.testing.assert_frame_equal(pd.read_csv(clean), _full_rebuild(str(txt), tmp_path))
+    return changed
+
+
+def test_unchanged_file_touches_no_keys(tmp_path):
+    lines = _lines()
+    assert len(_refresh(lines, tmp_path)) > 0
+    assert len(_refresh(lines, tmp_path)) == 0
+
+
+def test_changed_duplicated_pair_is_detected(tmp_path):
+    lines = _lines()
+    # Two identical lines for one key, then both changed the same way:
+    # a per-line xor cancels out both before and after
+    dup = lines[:1] * 2 + lines[1:]
+    _refresh(dup, tmp_path)
+    edited = [dup[0][:10] + "   9.99" + dup[0][17:]] * 2 + dup[2:]
+    changed = _refresh(edited, tmp_path)
+    assert changed[["state", "year"]].values.tolist() == [[1, int(dup[0][6:10])]]
+
+
+def test_swapped_lines_are_detected(tmp_path):
+    lines = _lines()
+    _refresh(lines, tmp_path)
+    # Exchange two divisions' lines for the same state and year
+    other = next(i for i, l in enumerate(lines) if l[2:4] == "02" and l[6:10] == lines[0][6:10])
+    swapped = list(lines)
+    swapped[0], swapped[other] = lines[other], lines[0]
+    changed = _refresh(swapped, tmp_path)
+    assert changed[["state", "year"]].values.tolist() == [[1, int(lines[0][6:10])]]
@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+from farm_precip_project import instrument as inst
+from farm_precip_project.instrument import (
+    disable_instrumentation, enable_instrumentation, instrument, instrumentation_records,
+    reset_instrumentation,
+)
+
+
+@instrument
+def inner(n):
+    return n
+
+
+@instrument
+def outer(n, barrier):
+    # Every thread is inside `outer` before any calls `inner`
+    barrier.wait()
+    for _ in range(n):
+        inner(n)
+    barrier.wait()
+    return n
+
+
+@pytest.fixture
+def recording():
+    reset_instrumentation()
+    enable_instrumentation()
+    yield
+    disable_instrumentation()
+    reset_instrumentation()
+
+
+def test_threads_keep_their_own_call_stacks(recording):
+    n_threads, n_calls = 8, 50
+    barrier = threading.Barrier(n_threads)
+    threads = [threading.Thread(target=outer, args=(n_calls, barrier)) for _ in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    records = instrumentation_records()
+    outers = [r for r in records if r["func"].endswith(".outer")]
+    inners = [r for r in records if r["func"].endswith(".inner")]
+    assert len(outers) == n_threads and len(inners) == n_threads * n_calls
+    assert all(r["depth"] == 0 and r["parent"] is None for r in outers)
+    assert all(r["depth"] == 1 and r["parent"].endswith(".outer") for r in inners)
+    assert inst._call_stack() == []
+
+
+@instrument
+def idle(started, finished):
+    started.set()
+    finished.wait(10)
+
+
+@instrument
+def busy(started, finished, path):
+    started.wait(10)
+    deadline = time.thread_time() + 0.3
+    while time.thread_time() < deadline:
+        pass
+    with open(path, "wb") as f:
+        f.write(b"x" * 2_000_000)
+    finished.set()
+
+
+def test_concurrent_calls_are_credited_with_their_own_work(recording, tmp_path):
+    started, finished = threading.Event(), threading.Event()
+    threads = [threading.Thread(target=idle, args=(started, finished)),
+               threading.Thread(target=busy, args=(started, finished, tmp_path / "out.bin"))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    records = {r["func"].rsplit(".", 1)[-1]: r for r in instrumentation_records()}
+    assert records["busy"]["cpu_s"] >= 0.3
+    assert records["idle"]["cpu_s"] < 0.05
+    if records["idle"]["bytes_written"] is not None:
+        assert records["busy"]["bytes_written"] >= 2_000_000
+        assert records["idle"]["bytes_written"] < 10_000
+    # The process peak mixes both calls, so neither gets one
+    assert records["idle"]["peak_rss_mb"] is None and records["busy"]["peak_rss_mb"] is None
+
+
+def test_lone_call_keeps_its_peak(recording):
+    inner(1)
+    assert instrumentation_records()[0]["peak_rss_mb"] is not None
+    assert inst._open_frames == []
+
+
+def test_single_profile_name(recording, tmp_path):
+    enable_instrumentation(profile="inner", profile_dir=str(tmp_path))
+    inner(1)
+    assert instrumentation_records()[-1]["profile"] is not None
+
+
+def test_disabled_calls_are_not_recorded(recording):
+    disable_instrumentation()
+    inner(1)
+    assert instrumentation_records() == []
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as tm
+
+from farm_precip_project.merge_csvs import merge_frames
+
+
+def _frames(dtype):
+    left = pd.DataFrame({
+        "state": pd.array([1, 1, 2, 2, 3], dtype=dtype),
+        "year": pd.array([2000, 2001, 2000, 2001, 2000], dtype=dtype),
+        "income": [10.0, 11.0, 20.0, 21.0, 30.0],
+    })
+    right = pd.DataFrame({
+        "state": pd.array([2, 1, 1, 3], dtype=dtype),
+        "year": pd.array([2001, 2000, 2001, 1999], dtype=dtype),
+        "yearly_avg": [0.5, 0.1, 0.2, 0.9],
+    })
+    return left, right
+
+
+def test_packed_join_matches_pd_merge():
+    left, right = _frames(np.int64)
+    tm.assert_frame_equal(merge_frames(left, right, ["state", "year"]),
+                          pd.merge(left, right, on=["state", "year"]))
+
+
+def test_nullable_keys_with_na_fall_back_to_pd_merge():
+    left, right = _frames("Int64")
+    left.loc[4, "year"] = pd.NA
+    right.loc[3, "year"] = pd.NA
+    out = merge_frames(left, right, ["state", "year"])
+    tm.assert_frame_equal(out, pd.merge(left, right, on=["state", "year"]))
+    assert out["state"].dtype == "Int64"
+
+
+def test_nullable_keys_without_na_fall_back_to_pd_merge():
+    left, right = _frames("Int64")
+    tm.assert_frame_equal(merge_frames(left, right, ["state", "year"]),
+                          pd.merge(left, right, on=["state", "year"]))
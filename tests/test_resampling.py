@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from farm_precip_project.resampling import bootstrap_corr, permutation_corr
+
+
+def _panel(offset):
+    rng = np.random.default_rng(0)
+    state = np.repeat(np.arange(1, 5), 30)
+    x = rng.normal(size=len(state))
+    # Income-like scale: a large level with small year-to-year changes
+    y = offset + 1e3 * (0.5 * x + rng.normal(size=len(state))) + 1e6 * state
+    return pd.DataFrame({"state": state, "yearly_avg": x, "income": y})
+
+
+def _expected(df):
+    r = [np.corrcoef(df["yearly_avg"], df["income"])[0, 1]]
+    r += [np.corrcoef(g["yearly_avg"], g["income"])[0, 1] for _, g in df.groupby("state")]
+    return np.array(r)
+
+
+def test_observed_r_is_precise_for_large_values():
+    df = _panel(offset=5e9)
+    for func in (bootstrap_corr, permutation_corr):
+        out = func(df, y="income", n_resamples=10, seed=0)
+        np.testing.assert_allclose(out["r"].to_numpy(), _expected(df), rtol=0, atol=1e-9)
+
+
+def test_draws_do_not_depend_on_the_offset():
+    small, large = _panel(offset=0), _panel(offset=5e9)
+    a = bootstrap_corr(small, y="income", n_resamples=200, seed=1)
+    b = bootstrap_corr(large, y="income", n_resamples=200, seed=1)
+    np.testing.assert_allclose(a[["r", "ci_low", "ci_high", "se"]], b[["r", "ci_low", "ci_high", "se"]],
+                               rtol=0, atol=1e-9)